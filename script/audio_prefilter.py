@@ -0,0 +1,139 @@
+import subprocess
+import numpy as np
+from smart_cut import probe_source
+
+# The audio is decoded to mono at this rate, enough for the kill sound and cheap to scan
+AUDIO_RATE = 8000
+# Resolution of the score envelopes (seconds per value)
+HOP_SECONDS = 0.02
+# Only the high band is kept for the onset envelope, the kill sound is a sharp high pitched cue
+# while footsteps, ability rumble and music sit lower
+ONSET_HIGHPASS_HZ = 1500
+# Default thresholds: robust z-score of the onset envelope, normalized correlation of the matched filter
+ONSET_THRESHOLD = 6.0
+MATCH_THRESHOLD = 0.5
+# Seconds kept before and after every audio hit, the kill banner appears with the sound and stays a while
+PAD_BEFORE = 0.5
+PAD_AFTER = 2.5
+# Offsets scored per FFT block by the matched filter, bounds its memory use on long VODs
+CORRELATION_BLOCK = 1 << 20
+
+
+def load_audio(video_path: str, sample_rate: int = AUDIO_RATE, highpass: float = None) -> np.ndarray:
+    """
+    Decodes only the audio track of `video_path` (the video stream is never touched) to a mono
+    float32 array at `sample_rate`, optionally keeping only the frequencies above `highpass` Hz.
+    """
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin", "-i", video_path, "-vn", "-sn",
+           "-ac", "1", "-ar", str(sample_rate)]
+    if highpass:
+        cmd += ["-af", f"highpass=f={highpass}"]
+    res = subprocess.run(cmd + ["-f", "f32le", "-"], capture_output=True)
+    if res.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to decode the audio of '{video_path}': "
+                           f"{res.stderr.decode(errors='replace').strip()}")
+    return np.frombuffer(res.stdout, dtype=np.float32)
+
+
+def _frames(values: np.ndarray, hop: int) -> np.ndarray:
+    """Views `values` as rows of `hop` consecutive values, dropping the incomplete last row."""
+    count = len(values) // hop
+    return values[:count * hop].reshape(count, hop)
+
+
+def onset_envelope(samples: np.ndarray, sample_rate: int = AUDIO_RATE, hop_seconds: float = HOP_SECONDS):
+    """
+    Onset strength of every `hop_seconds` of audio: how much its energy (in dB) rose since the
+    previous hop. Sudden sounds score high, steady noise scores around zero and fades below it.
+    """
+    energy = np.mean(np.square(_frames(samples, max(int(sample_rate * hop_seconds), 1))), axis=1)
+    level = 10 * np.log10(energy + 1e-10)
+    return np.diff(level, prepend=level[:1])
+
+
+def matched_filter_envelope(samples: np.ndarray, reference: np.ndarray, sample_rate: int = AUDIO_RATE,
+                            hop_seconds: float = HOP_SECONDS):
+    """
+    Best normalized correlation (-1 to 1) of `reference` (a recorded kill sound) with the audio
+    starting within every `hop_seconds`. Scores are independent of the volume of the game audio.
+    """
+    hop = max(int(sample_rate * hop_seconds), 1)
+    size = len(reference)
+    if size == 0 or len(samples) < size:
+        return np.zeros(0, dtype=np.float32)
+    reference = reference - reference.mean()
+    reference_norm = np.linalg.norm(reference)
+    fft_size = 1 << int(np.ceil(np.log2(max(CORRELATION_BLOCK, hop) + size)))
+    reference_fft = np.conj(np.fft.rfft(reference, fft_size))
+    step = (fft_size - size + 1) // hop * hop  # offsets per block, in whole hops
+
+    # Correlation (by FFT, overlap-save), energy under the reference and the per-hop best score are all
+    # computed one block of offsets at a time, only the envelope spans the whole VOD
+    envelope = np.empty((len(samples) - size + 1) // hop, dtype=np.float32)
+    num_offsets = len(envelope) * hop
+    for start in range(0, num_offsets, step):
+        count = min(step, num_offsets - start)
+        block = samples[start:start + count + size - 1]
+        corr = np.fft.irfft(np.fft.rfft(block, fft_size) * reference_fft, fft_size)[:count]
+        cumsum = np.concatenate(([0.0], np.cumsum(np.square(block, dtype=np.float64))))
+        local_energy = cumsum[size:size + count] - cumsum[:count]
+        score = corr / (np.sqrt(np.maximum(local_energy, 0.0)) * reference_norm + 1e-10)
+        envelope[start // hop:(start + count) // hop] = np.max(score.reshape(-1, hop), axis=1)
+    return envelope
+
+
+def _robust_z(envelope: np.ndarray) -> np.ndarray:
+    """Scores in median absolute deviations above the median, so thresholds hold across VOD volumes."""
+    median = np.median(envelope)
+    mad = np.median(np.abs(envelope - median)) or 1e-10
+    return (envelope - median) / (1.4826 * mad)
+
+
+def _hits_to_windows(hit_times: np.ndarray, pad_before: float, pad_after: float):
+    """Pads every hit time into a (start, end) window and merges the windows that overlap."""
+    windows = []
+    for time in hit_times:
+        start, end = max(float(time) - pad_before, 0.0), float(time) + pad_after
+        if windows and start <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], end)
+        else:
+            windows.append([start, end])
+    return [(start, end) for start, end in windows]
+
+
+def candidate_windows(video_path: str, reference_path: str = None, threshold: float = None,
+                      pad_before: float = PAD_BEFORE, pad_after: float = PAD_AFTER,
+                      sample_rate: int = AUDIO_RATE):
+    """
+    Scans the audio of `video_path` for kill sounds and returns the sorted (start, end) windows (in
+    seconds of the video) worth running the detector on, see the `windows` argument of `detect_kills`.
+
+    Without a `reference_path`, hits are the sharp high-pitched onsets scoring `threshold` robust
+    z-scores (default `ONSET_THRESHOLD`). With one, the audio of that file (a clip of the kill
+    sound) is matched against the VOD and hits are offsets whose normalized correlation reaches
+    `threshold` (default `MATCH_THRESHOLD`). Every hit is padded by `pad_before` and `pad_after`.
+    """
+    info = probe_source(video_path)
+    if not info["has_audio"]:
+        raise ValueError(f"'{video_path}' has no audio track to pre-filter on")
+
+    # 1. Score every hop of the audio
+    if reference_path is None:
+        envelope = _robust_z(onset_envelope(load_audio(video_path, sample_rate, ONSET_HIGHPASS_HZ), sample_rate))
+        threshold = ONSET_THRESHOLD if threshold is None else threshold
+    else:
+        reference = load_audio(reference_path, sample_rate)
+        envelope = matched_filter_envelope(load_audio(video_path, sample_rate), reference, sample_rate)
+        threshold = MATCH_THRESHOLD if threshold is None else threshold
+
+    # 2. Hits in video time (the audio track may start later than the video). The envelopes step by a
+    # whole number of samples, which is not exactly HOP_SECONDS at every sample rate
+    hop_duration = max(int(sample_rate * HOP_SECONDS), 1) / sample_rate
+    hit_times = np.flatnonzero(envelope >= threshold) * hop_duration + info["audio_offset"]
+    windows = _hits_to_windows(hit_times, pad_before, pad_after)
+
+    covered = sum(end - start for start, end in windows)
+    total = len(envelope) * hop_duration
+    print(f"Audio pre-filter: {len(windows)} candidate windows covering {covered:.1f}s "
+          f"of {total:.1f}s ({100 * covered / total if total else 0:.1f}%)")
+    return windows
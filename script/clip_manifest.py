@@ -0,0 +1,48 @@
+import json
+import os
+
+# Written into the clips folder instead of encoded clips when extracting virtual clips
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def manifest_path(clips_folder: str) -> str:
+    return os.path.join(clips_folder, MANIFEST_NAME)
+
+
+def write_manifest(clips_folder: str, video_path: str, windows, info: dict) -> list:
+    """
+    Describes every (start, end) window of `video_path` as a virtual clip in the clips folder's
+    manifest: source path, start and end (in seconds of the source), FPS and audio offset (how much
+    later than the video the source audio starts). Returns the clip entries.
+    """
+    source = os.path.abspath(video_path)
+    clips = [{"name": f"kill{idx+1}", "source": source, "start": float(start), "end": float(end),
+              "fps": info["fps"], "audio_offset": info["audio_offset"]}
+             for idx, (start, end) in enumerate(windows)]
+
+    path = manifest_path(clips_folder)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "clips": clips}, f, indent=2)
+    os.replace(tmp_path, path)
+    return clips
+
+
+def remove_manifest(clips_folder: str):
+    """Deletes the manifest of `clips_folder` if there is one, once the folder holds encoded clips again."""
+    path = manifest_path(clips_folder)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def load_manifest(clips_folder: str) -> list:
+    """The virtual clips of `clips_folder` in order, or None when it holds encoded clips instead."""
+    path = manifest_path(clips_folder)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"unsupported clip manifest version {manifest.get('version')} in '{path}'")
+    return manifest["clips"]
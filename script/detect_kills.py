@@ -1,46 +1,1117 @@
+import copy
 import cv2
-from ultralytics import YOLO
+import numpy as np
 import os
+import glob
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from detections_io import (DETECTION_DTYPE, detections_path, load_detections, save_detections, save_timestamps,
+                           to_array, to_tuples, write_detections)
+from disk_cache import DiskCache, file_fingerprint, file_hash, make_key
+from ffmpeg_frames import INGEST_SIZE, FFmpegFrames
+from model_backends import BACKENDS
+from model_registry import DEFAULT_WEIGHTS_PATH, get_model
+from video_index import load_index
 
-# Load the trained model
-model = YOLO("runs/detect/train12/weights/best.pt")  # Adjust the path to your trained model
+# Run inference on every 5th frame by default (6 samples per second on 30 FPS footage)
+DEFAULT_STRIDE = 5
+# From this stride on we seek straight to the next sampled frame instead of grabbing every frame
+# in between. A seek decodes forward from the previous keyframe, so it only pays off once the
+# stride is longer than a typical GOP (OBS/x264 default to a keyframe every ~250 frames).
+SEEK_MIN_STRIDE = 300
+# Number of sampled frames sent to the model in a single call
+DEFAULT_BATCH_SIZE = 8
+# Number of decoded batches the decoder may run ahead of the inference workers when pipelined
+DEFAULT_QUEUE_SIZE = 4
+# Example HUD regions for `roi`, as (left, top, right, bottom) fractions of the frame size:
+# the kill feed in the top-right corner and the kill banner above the ability bar
+VALORANT_HUD_ROI = [(0.70, 0.04, 1.00, 0.30), (0.35, 0.68, 0.65, 0.88)]
+# Minimum confidence for a box to count as a kill (same as the ultralytics default)
+DEFAULT_CONF = 0.25
+# Where sampled frames come from: OpenCV decodes full frames, "ffmpeg" selects, crops and scales them
+# inside the decoder (see ffmpeg_frames.py)
+FRAME_SOURCES = ("opencv", "ffmpeg")
 
-def detect_kills(video_path: str, timestamps_file: str):
-    # Initialize list to store timestamps for kills
-    timestamps = []
+# On-disk cache of raw detections, keyed by video content, model weights and sampling settings
+DETECTION_CACHE_DIR = ".detection_cache"
+DETECTION_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Cached detections keep every box down to this confidence, so raising the threshold is still a hit
+CACHE_CONF_FLOOR = 0.05
 
-    # Open video
+# Size of the grayscale thumbnail the frame-difference gate compares (width, height)
+GATE_THUMBNAIL_SIZE = (64, 36)
+
+# Seconds of video each shard decodes past its own boundaries in sharded mode
+DEFAULT_SHARD_OVERLAP = 1.0
+
+# Follow mode: how often a recording is checked for new frames, and how long it must stay unchanged
+# before it is considered finished (both in seconds)
+FOLLOW_POLL_INTERVAL = 2.0
+FOLLOW_IDLE_TIMEOUT = 15.0
+# Files picked up as segments when following a directory of split recordings
+SEGMENT_EXTENSIONS = (".mkv", ".ts", ".flv", ".mp4", ".mov")
+
+# Batch mode: number of videos decoded at the same time, all feeding the same inference batches
+DEFAULT_BATCH_DECODERS = 2
+
+# Stages of the detection loop timed by DetectionStats, and the percentiles reported for each
+TIMING_STAGES = ("decode", "gate", "preprocess", "inference", "postprocess")
+TIMING_PERCENTILES = (50, 90, 99)
+
+
+def _iter_sampled_frames(cap, stride: int, start_frame: int = 0, end_frame: int = None,
+                         seek_min_stride: int = SEEK_MIN_STRIDE, keyframes=None):
+    """
+    Yields (frame_index, frame) for every `stride`-th frame of `cap` in [start_frame, end_frame).
+
+    Frames in between are only grabbed (demuxed/decoded, no BGR conversion and no copy into Python),
+    and when the stride is at least `seek_min_stride` the capture seeks directly to each sampled frame,
+    so the decode cost follows the number of samples rather than the length of the video.
+
+    With `keyframes` (the sorted keyframe frame indices of the video, see video_index.py) the guess is
+    replaced by the actual GOP layout: the capture seeks exactly when a keyframe lies between its
+    position and the next sampled frame, which is when seeking skips decoding work.
+    """
+    def should_seek(position, target):
+        if keyframes is None:
+            return target - position >= seek_min_stride
+        # A seek restarts decoding at the last keyframe before `target`, only useful if that is past `position`
+        return np.searchsorted(keyframes, target, "right") > np.searchsorted(keyframes, position, "right")
+
+    seek = stride >= seek_min_stride if keyframes is None else None
+    frame_idx = start_frame
+
+    # Move the capture to `start_frame`: grab forward over short gaps, seek over long ones
+    position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    if 0 < start_frame - position and not should_seek(position, start_frame):
+        for _ in range(start_frame - position):
+            if not cap.grab():
+                return
+    elif start_frame != position:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+
+    while end_frame is None or frame_idx < end_frame:
+        if (frame_idx - start_frame) % stride == 0:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield frame_idx, frame
+            frame_idx += 1
+        elif seek or (seek is None and should_seek(frame_idx, frame_idx + stride - (frame_idx - start_frame) % stride)):
+            # Jump to the next sampled frame, the capture decodes forward from the nearest keyframe
+            frame_idx += stride - (frame_idx - start_frame) % stride
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+        else:
+            if not cap.grab():
+                break
+            frame_idx += 1
+
+
+def _iter_batches(frames, batch_size: int):
+    """Groups the (frame_index, frame) pairs of `frames` into lists of at most `batch_size` items."""
+    batch = []
+    for item in frames:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _validate_roi(roi):
+    """Checks that every ROI rectangle is a (left, top, right, bottom) tuple of fractions in [0, 1]."""
+    for rect in roi:
+        if len(rect) != 4:
+            raise ValueError(f"ROI rectangles need 4 values (left, top, right, bottom), got {rect}")
+        left, top, right, bottom = rect
+        if not (0 <= left < right <= 1 and 0 <= top < bottom <= 1):
+            raise ValueError(f"ROI rectangle {rect} must satisfy 0 <= left < right <= 1 and 0 <= top < bottom <= 1")
+
+
+def _crop_regions(frame, roi):
+    """
+    Cuts the fractional ROI rectangles out of `frame` and returns a list of (crop, (x_offset, y_offset))
+    where the offset is the crop's top-left corner in full-frame pixels. Crops are views, not copies.
+    """
+    height, width = frame.shape[:2]
+    regions = []
+    for left, top, right, bottom in roi:
+        x0, y0 = int(left * width), int(top * height)
+        x1, y1 = int(round(right * width)), int(round(bottom * height))
+        regions.append((frame[y0:y1, x0:x1], (x0, y0)))
+    return regions
+
+
+class DetectionSettings:
+    """
+    Model and batching settings shared by every stage of a detection run, and taken by every
+    `detect_kills*` entry point (the defaults when none is given).
+
+    Sampled frames are sent to the model `batch_size` at a time. With `pipelined=True`, decoding runs
+    on its own thread and feeds `num_workers` inference workers through a queue holding at most
+    `queue_size` batches (batch mode always works this way, sharded and follow mode never do).
+
+    `roi` is an optional list of (left, top, right, bottom) rectangles given as fractions of the
+    frame size (see `VALORANT_HUD_ROI`). When set, only those HUD regions are sent to the model.
+    Only boxes with at least `conf` confidence are kept.
+
+    With a `gate_threshold`, a sampled frame whose (ROI) thumbnail differs from the last inferred frame
+    by less than that many gray levels on average skips inference and reuses its detections.
+
+    `backend` selects the inference runtime ("torch", "onnx" or "openvino", see model_backends.py),
+    optionally with the `int8` quantized export. Exports are created next to the weights on first use.
+    The model for `weights_path` is loaded on the first detection and stays warm for later calls.
+    """
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE, pipelined: bool = False, num_workers: int = 1,
+                 queue_size: int = DEFAULT_QUEUE_SIZE, roi=None, conf: float = DEFAULT_CONF,
+                 gate_threshold: float = None, backend: str = "torch", int8: bool = False,
+                 weights_path: str = DEFAULT_WEIGHTS_PATH):
+        self.batch_size = batch_size
+        self.pipelined = pipelined
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+        self.roi = roi
+        self.conf = conf
+        self.gate_threshold = gate_threshold
+        self.backend = backend
+        self.int8 = int8
+        self.weights_path = weights_path
+
+    def validate(self, stride: int):
+        if stride < 1:
+            raise ValueError(f"stride must be at least 1, got {stride}")
+        if self.batch_size < 1:
+            raise ValueError(f"batch_size must be at least 1, got {self.batch_size}")
+        if self.num_workers < 1:
+            raise ValueError(f"num_workers must be at least 1, got {self.num_workers}")
+        if self.queue_size < 1:
+            # queue.Queue(maxsize=0) is unbounded, decoding would run ahead of inference without limit
+            raise ValueError(f"queue_size must be at least 1, got {self.queue_size}")
+        if not 0 <= self.conf <= 1:
+            raise ValueError(f"conf must be in [0, 1], got {self.conf}")
+        if self.gate_threshold is not None and self.gate_threshold < 0:
+            raise ValueError(f"gate_threshold must be positive, got {self.gate_threshold}")
+        if self.backend not in BACKENDS:
+            raise ValueError(f"unknown backend '{self.backend}', expected one of {BACKENDS}")
+        if self.roi:
+            _validate_roi(self.roi)
+
+    def cache_key_parts(self) -> dict:
+        """The settings that change the raw detections (batching and threading do not)."""
+        return {"roi": [list(rect) for rect in self.roi] if self.roi else None,
+                "gate_threshold": self.gate_threshold, "backend": self.backend, "int8": self.int8}
+
+
+class DetectionStats:
+    """
+    Counters and timings filled in by a detection run. Pass one to a detect function to see how many
+    sampled frames were decoded, went through the model or were skipped by the frame-difference gate,
+    and where the time went.
+
+    Each stage of `TIMING_STAGES` gets one sample per call: "decode" and "gate" per sampled frame,
+    "preprocess", "inference" and "postprocess" per model batch (letterboxing, the forward pass and NMS
+    as reported by ultralytics, plus our own ROI cropping and box extraction).
+    """
+    def __init__(self):
+        self.frames_decoded = 0
+        self.frames_inferred = 0
+        self.frames_gated = 0
+        self.wall_time = 0.0
+        self.timings = {stage: [] for stage in TIMING_STAGES}
+
+    def add_time(self, stage: str, seconds: float):
+        self.timings[stage].append(seconds)
+
+    def merge(self, other: "DetectionStats"):
+        """Adds the counts and timings of a run that went on in parallel (e.g. another shard)."""
+        self.frames_decoded += other.frames_decoded
+        self.frames_inferred += other.frames_inferred
+        self.frames_gated += other.frames_gated
+        # Parallel runs overlap, so the combined run took as long as the slowest of them
+        self.wall_time = max(self.wall_time, other.wall_time)
+        for stage, samples in other.timings.items():
+            self.timings[stage].extend(samples)
+
+    @property
+    def gated_ratio(self) -> float:
+        total = self.frames_inferred + self.frames_gated
+        return self.frames_gated / total if total else 0.0
+
+    @property
+    def effective_fps(self) -> float:
+        """Sampled frames handled per second of wall time."""
+        return self.frames_decoded / self.wall_time if self.wall_time else 0.0
+
+    def stage_summary(self) -> dict:
+        """Per stage: number of samples, total seconds and mean/percentile milliseconds per sample."""
+        summary = {}
+        for stage, samples in self.timings.items():
+            # Empty stages (e.g. "gate" without a gate_threshold) report zeros
+            samples_ms = np.asarray(samples or [0.0], dtype=np.float64) * 1000.0
+            summary[stage] = {"count": len(samples), "total_s": float(sum(samples)),
+                              "mean_ms": float(samples_ms.mean())}
+            for p, value in zip(TIMING_PERCENTILES, np.percentile(samples_ms, TIMING_PERCENTILES)):
+                summary[stage][f"p{p}_ms"] = float(value)
+        return summary
+
+    def to_dict(self) -> dict:
+        return {
+            "frames_decoded": self.frames_decoded,
+            "frames_inferred": self.frames_inferred,
+            "frames_gated": self.frames_gated,
+            "gated_ratio": self.gated_ratio,
+            "wall_time_s": self.wall_time,
+            "effective_fps": self.effective_fps,
+            "stages": self.stage_summary(),
+        }
+
+    def write_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def __repr__(self):
+        totals = ", ".join(f"{stage}={sum(samples):.2f}s" for stage, samples in self.timings.items())
+        return (f"DetectionStats(frames_decoded={self.frames_decoded}, frames_inferred={self.frames_inferred}, "
+                f"frames_gated={self.frames_gated}, gated_ratio={self.gated_ratio:.1%}, "
+                f"effective_fps={self.effective_fps:.1f}, {totals})")
+
+
+def _timed_frames(frames, stats: DetectionStats):
+    """Passes (frame_index, frame) pairs through, timing how long each one took to decode."""
+    frames = iter(frames)
+    while True:
+        start = time.perf_counter()
+        pair = next(frames, None)
+        if pair is None:
+            return
+        stats.add_time("decode", time.perf_counter() - start)
+        stats.frames_decoded += 1
+        yield pair
+
+
+class _FrameGate:
+    """
+    Cheap pre-filter in front of the model: a frame is skipped when the mean absolute difference between
+    its downscaled grayscale thumbnail (of the ROI, or of the whole frame) and the one of the last inferred
+    frame is below `threshold` (in 0-255 gray levels).
+    """
+    def __init__(self, threshold: float, roi=None):
+        self.threshold = threshold
+        self.roi = roi
+        self.reference = None
+
+    def _thumbnail(self, frame):
+        regions = [image for image, _ in _crop_regions(frame, self.roi)] if self.roi else [frame]
+        thumbs = [cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), GATE_THUMBNAIL_SIZE,
+                             interpolation=cv2.INTER_AREA) for image in regions]
+        return np.concatenate(thumbs, axis=0).astype(np.int16)
+
+    def reset(self):
+        self.reference = None
+
+    def unchanged(self, frame) -> bool:
+        """True if `frame` can reuse the previous result, otherwise it becomes the new reference."""
+        thumb = self._thumbnail(frame)
+        if self.reference is not None and np.abs(thumb - self.reference).mean() < self.threshold:
+            return True
+        self.reference = thumb
+        return False
+
+
+def _gate_frames(frames, stride: int, settings: DetectionSettings, carried: list, stats: DetectionStats):
+    """
+    Passes through the (frame_index, frame) pairs that need inference. Frames the gate considers unchanged
+    are not yielded, instead (frame_index, reference_frame_index) is appended to `carried` so they can
+    inherit the detections of the last inferred frame. The gate starts over after any gap in the sampling.
+    """
+    gate = _FrameGate(settings.gate_threshold, settings.roi) if settings.gate_threshold is not None else None
+    reference_idx = previous_idx = None
+    for frame_idx, frame in frames:
+        if gate is not None:
+            if previous_idx is not None and frame_idx - previous_idx != stride:
+                gate.reset()
+            previous_idx = frame_idx
+            start = time.perf_counter()
+            unchanged = gate.unchanged(frame)
+            stats.add_time("gate", time.perf_counter() - start)
+            if unchanged:
+                carried.append((frame_idx, reference_idx))
+                stats.frames_gated += 1
+                continue
+        reference_idx = frame_idx
+        stats.frames_inferred += 1
+        yield frame_idx, frame
+
+
+def _carry_forward(detections, carried, fps: float):
+    """Copies the detections of each gated frame's reference frame onto the gated frame, in frame order."""
+    by_frame = {}
+    for det in detections:
+        by_frame.setdefault(det[0], []).append(det)
+    for frame_idx, reference_idx in carried:
+        by_frame[frame_idx] = [(frame_idx, frame_idx / fps, *det[2:]) for det in by_frame.get(reference_idx, [])]
+    return [det for frame_idx in sorted(by_frame) for det in by_frame[frame_idx]]
+
+
+def _get_model(settings: DetectionSettings, slot: int = 0):
+    """Returns the warm model for the weights and backend selected in `settings` (see model_registry.py)."""
+    return get_model(settings.weights_path, settings.backend, settings.int8, slot)
+
+
+def _infer_batch(batch, fps: float, settings: DetectionSettings, batch_model=None, stats: DetectionStats = None):
+    """
+    Runs the model once on a batch of (frame_index, frame) pairs and returns one detection per box as
+    (frame_index, timestamp, class, confidence, x1, y1, x2, y2), with the timestamp derived from the
+    index of the frame the box was found in and the box in full-frame pixel coordinates.
+
+    When `settings.roi` is given, only the ROI crops of each frame are sent to the model.
+    """
+    batch_model = batch_model or _get_model(settings)
+
+    # Every frame contributes either itself or one crop per ROI rectangle
+    start = time.perf_counter()
+    images, origins = [], []
+    for frame_idx, frame in batch:
+        regions = _crop_regions(frame, settings.roi) if settings.roi else [(frame, (0, 0))]
+        for image, offset in regions:
+            images.append(image)
+            origins.append((frame_idx, offset))
+    crop_time = time.perf_counter() - start
+    results = batch_model(images, conf=settings.conf, verbose=False)
+
+    start = time.perf_counter()
+    detections = []
+    for (frame_idx, (x_offset, y_offset)), result in zip(origins, results):
+        timestamp = frame_idx / fps  # Derive timestamp based on frame index and FPS
+        boxes = result.boxes
+        for cls, conf, (x1, y1, x2, y2) in zip(boxes.cls.tolist(), boxes.conf.tolist(), boxes.xyxy.tolist()):
+            # Shift crop coordinates back into full-frame space
+            detections.append((frame_idx, timestamp, int(cls), conf,
+                               x1 + x_offset, y1 + y_offset, x2 + x_offset, y2 + y_offset))
+
+    if stats is not None and results:
+        # ultralytics reports its own stages in milliseconds per image of the batch
+        speed = results[0].speed
+        batch_ms = {stage: (speed.get(stage) or 0.0) * len(images)
+                    for stage in ("preprocess", "inference", "postprocess")}
+        stats.add_time("preprocess", crop_time + batch_ms["preprocess"] / 1000.0)
+        stats.add_time("inference", batch_ms["inference"] / 1000.0)
+        stats.add_time("postprocess", time.perf_counter() - start + batch_ms["postprocess"] / 1000.0)
+    return detections
+
+
+def _put_unless_stopped(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """Waits for room in `q` to put `item`, but gives up (and returns False) as soon as `stop` is set."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _run_workers(producers, consume, worker_models, queue_size: int, max_items: int = 1):
+    """
+    The threading shared by the pipelined and the batch modes. Every callable of `producers` runs on
+    its own thread and feeds a queue holding at most `queue_size` items through the `put(item)` function
+    it is called with, which blocks while the queue is full and returns False once the run is stopping.
+    One thread per model of `worker_models` takes up to `max_items` queued items at a time and hands
+    them to `consume(worker_model, items)`. The first exception raised on any thread stops the run,
+    and is raised here once every thread has finished.
+    """
+    items = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+
+    def put(item):
+        return _put_unless_stopped(items, item, stop)
+
+    def produce(producer):
+        try:
+            producer(put)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    def work(worker_model):
+        last = False
+        while not last:
+            # Take whatever is queued, up to `max_items` and the end-of-stream marker
+            taken = [items.get()]
+            while taken[-1] is not None and len(taken) < max_items:
+                try:
+                    taken.append(items.get_nowait())
+                except queue.Empty:
+                    break
+            if taken[-1] is None:
+                last = True
+                taken.pop()
+            if stop.is_set() or not taken:
+                continue  # Something failed, just drain the queue until the end-of-stream marker
+            try:
+                consume(worker_model, taken)
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+
+    producer_threads = [threading.Thread(target=produce, args=(p,), daemon=True) for p in producers]
+    worker_threads = [threading.Thread(target=work, args=(m,), daemon=True) for m in worker_models]
+    for t in producer_threads + worker_threads:
+        t.start()
+    for t in producer_threads:
+        t.join()
+    # One end-of-stream marker per worker, workers keep draining so these never block forever
+    for _ in worker_threads:
+        items.put(None)
+    for t in worker_threads:
+        t.join()
+
+    if errors:
+        raise errors[0]
+
+
+def _run_pipelined(frames, fps: float, settings: DetectionSettings, stats: DetectionStats = None):
+    """
+    Decodes `frames` on a background thread while `settings.num_workers` inference threads drain a
+    bounded queue of batches, so decoding and inference overlap. The decoder blocks when the queue is
+    full, and the detections are returned in frame order regardless of which worker handled which batch.
+    """
+    results = {}  # batch sequence number -> detections found in that batch
+
+    def decode(put):
+        for seq, batch in enumerate(_iter_batches(frames, settings.batch_size)):
+            if not put((seq, batch)):
+                return
+
+    def infer(worker_model, items):
+        for seq, batch in items:
+            results[seq] = _infer_batch(batch, fps, settings, worker_model, stats)
+
+    # The model is not safe to share between threads, every extra worker gets its own instance
+    worker_models = [_get_model(settings, slot) for slot in range(settings.num_workers)]
+    _run_workers([decode], infer, worker_models, settings.queue_size)
+    return [det for seq in sorted(results) for det in results[seq]]
+
+
+def _iter_range_frames(cap, ranges, stride: int, keyframes=None):
+    """Chains `_iter_sampled_frames` over a list of (start_frame, end_frame) ranges, in order."""
+    for start_frame, end_frame in ranges:
+        yield from _iter_sampled_frames(cap, stride, start_frame, end_frame, keyframes=keyframes)
+
+
+def _detect_ranges(cap, fps: float, ranges, stride: int, settings: DetectionSettings,
+                   stats: DetectionStats = None, keyframes=None):
+    """Runs the detector on every `stride`-th frame of each (start_frame, end_frame) range of `cap`."""
+    # Only decode the frames we are going to run the model on
+    return _detect_frames(_iter_range_frames(cap, ranges, stride, keyframes), fps, stride, settings, stats)
+
+
+def _window_ranges(windows, fps: float, stride: int):
+    """
+    Turns (start, end) time windows in seconds into sorted, merged (start_frame, end_frame) ranges whose
+    starts lie on the sampling grid, so the sampled frames are a subset of a full run's.
+    """
+    ranges = []
+    for start, end in sorted(windows):
+        start_frame = int(max(start, 0.0) * fps) // stride * stride
+        end_frame = int(np.ceil(end * fps))
+        if ranges and start_frame <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end_frame)
+        elif start_frame < end_frame:
+            ranges.append([start_frame, end_frame])
+    return [(start_frame, end_frame) for start_frame, end_frame in ranges]
+
+
+def _index_keyframes(video_path: str, use_index: bool):
+    """The keyframe frame indices from the video's cached packet index (see video_index.py), if asked for."""
+    return load_index(video_path).keyframe_frames() if use_index else None
+
+
+def _roi_bounds(roi):
+    """
+    The bounding rectangle of the ROI rectangles, and the rectangles re-expressed as fractions of it,
+    so a frame cropped to the bounds can be cut up the same way as the full frame.
+    """
+    left, top = min(rect[0] for rect in roi), min(rect[1] for rect in roi)
+    right, bottom = max(rect[2] for rect in roi), max(rect[3] for rect in roi)
+    width, height = right - left, bottom - top
+    inner = [(min(max((l - left) / width, 0.0), 1.0), min(max((t - top) / height, 0.0), 1.0),
+              min(max((r - left) / width, 0.0), 1.0), min(max((b - top) / height, 0.0), 1.0))
+             for l, t, r, b in roi]
+    return (left, top, right, bottom), inner
+
+
+def _detect_ffmpeg(video_path: str, stride: int, settings: DetectionSettings, stats: DetectionStats = None):
+    """
+    Same as `_detect_ranges` over the whole video, with the frames coming from an ffmpeg pipe. ffmpeg
+    crops to the bounding box of `settings.roi`, or scales full frames down to the model input size,
+    and the boxes are mapped back to source frame coordinates.
+    """
+    crop, frame_settings = None, settings
+    if settings.roi:
+        crop, inner_roi = _roi_bounds(settings.roi)
+        frame_settings = copy.copy(settings)
+        frame_settings.roi = inner_roi
+
+    # Frames stay in the ring buffer until their batch is inferred, leave room for every batch in flight
+    in_flight = settings.queue_size + settings.num_workers + 2 if settings.pipelined else 2
+    frames = FFmpegFrames(video_path, stride, crop=crop, size=None if settings.roi else INGEST_SIZE,
+                          num_buffers=in_flight * settings.batch_size)
+    detections = _detect_frames(frames, frames.fps, stride, frame_settings, stats)
+    return [(*det[:4], *frames.to_source_box(*det[4:])) for det in detections]
+
+
+def _detect_frames(frames, fps: float, stride: int, settings: DetectionSettings, stats: DetectionStats = None):
+    """Runs the detector on an iterator of sampled (frame_index, frame) pairs taken `stride` frames apart."""
+    stats = stats or DetectionStats()
+    carried = []  # (gated frame index, frame index whose detections it reuses)
+    start = time.perf_counter()
+
+    # Skip unchanged frames, and run the rest through the model in batches
+    frames = _gate_frames(_timed_frames(frames, stats), stride, settings, carried, stats)
+    if settings.pipelined:
+        detections = _run_pipelined(frames, fps, settings, stats)
+    else:
+        detections = []
+        for batch in _iter_batches(frames, settings.batch_size):
+            detections.extend(_infer_batch(batch, fps, settings, stats=stats))
+
+    if carried:
+        detections = _carry_forward(detections, carried, fps)
+    stats.wall_time += time.perf_counter() - start
+    return detections
+
+
+def _detection_cache_key(video_path: str, settings: DetectionSettings, **key_parts) -> str:
+    """Cache key of the raw detections of `video_path`: its content, the weights and the sampling settings."""
+    return make_key(video=file_fingerprint(video_path), weights=file_hash(settings.weights_path),
+                    conf_floor=min(settings.conf, CACHE_CONF_FLOOR), format=str(DETECTION_DTYPE),
+                    **settings.cache_key_parts(), **key_parts)
+
+
+def _raw_settings(settings: DetectionSettings) -> DetectionSettings:
+    """Copy of `settings` that keeps every box down to `CACHE_CONF_FLOOR`, for storing in the cache."""
+    raw_settings = copy.copy(settings)
+    raw_settings.conf = min(settings.conf, CACHE_CONF_FLOOR)
+    return raw_settings
+
+
+def _store_detections(cache: DiskCache, key: str, detections):
+    def write(path):
+        with open(path, "wb") as f:
+            write_detections(f, to_array(detections))
+    cache.put(key, write, ".npy")
+
+
+def _cached_detections(cache: DiskCache, video_path: str, settings: DetectionSettings, run, **key_parts):
+    """
+    Returns `run(settings)` through the detection cache. Entries are keyed by the video's content,
+    the weights and the sampling settings, and hold every box down to `CACHE_CONF_FLOOR` so that a
+    different confidence threshold is answered by filtering the cached boxes.
+    """
+    if cache is None:
+        return run(settings)
+
+    key = _detection_cache_key(video_path, settings, **key_parts)
+    cached_path = cache.get(key, ".npy")
+    if cached_path is not None:
+        print(f"Using cached detections for '{video_path}'")
+        detections = to_tuples(load_detections(cached_path, mmap=False))
+    else:
+        detections = run(_raw_settings(settings))
+        _store_detections(cache, key, detections)
+
+    return [det for det in detections if det[3] >= settings.conf]
+
+
+def _save_outputs(detections, detections_file: str, timestamps_file: str = None, stats: DetectionStats = None,
+                  stats_file: str = None):
+    """
+    Saves the detections as a columnar array to `detections_file` (see detections_io.py), plus the
+    optional one-timestamp-per-box text export and JSON run statistics, and returns the array.
+    """
+    array = to_array(detections)
+    save_detections(detections_file, array)
+    print(f"Detected kills saved to '{detections_file}'")
+
+    if timestamps_file:
+        save_timestamps(timestamps_file, array)
+        print(f"Detected kill timestamps saved to '{timestamps_file}'")
+
+    if stats_file and stats is not None:
+        stats.write_json(stats_file)
+        print(f"Detection stats saved to '{stats_file}'")
+    return array
+
+
+def detect_kills(video_path: str, detections_file: str, stride: int = DEFAULT_STRIDE,
+                 settings: DetectionSettings = None, cache: DiskCache = None, stats: DetectionStats = None,
+                 timestamps_file: str = None, stats_file: str = None, source: str = "opencv",
+                 use_index: bool = False, windows=None):
+    """
+    Runs the kill detector on every `stride`-th frame of `video_path` and saves every detected box
+    (frame, timestamp, class, confidence and box) to `detections_file`, see detections_io.py. The model,
+    batching, ROI, confidence and gating come from `settings` (see `DetectionSettings`). Returns the
+    detections array. `timestamps_file` optionally also exports one timestamp per box as text.
+
+    When a `cache` is given, the raw detections are stored in it and reused by later runs on the
+    same video, weights and sampling settings.
+
+    Pass a `DetectionStats` as `stats` to get the number of decoded, inferred and gated frames, the
+    effective FPS and per-stage timings, and/or a `stats_file` to save them as JSON next to the detections.
+
+    With `source="ffmpeg"` the frames are decoded by an ffmpeg subprocess that drops the unsampled
+    frames and crops to the ROI (or scales down to the model input size) before handing them over.
+    With `use_index=True` the OpenCV source seeks by the video's keyframe index (see video_index.py,
+    built and cached next to the video on first use) instead of guessing from the stride.
+
+    `windows` restricts detection to a list of (start, end) time ranges in seconds, e.g. the candidate
+    windows of the audio pre-filter (see audio_prefilter.py). Frames outside them are never decoded.
+    """
+    settings = settings or DetectionSettings()
+    settings.validate(stride)
+    if source not in FRAME_SOURCES:
+        raise ValueError(f"unknown frame source '{source}', expected one of {FRAME_SOURCES}")
+    if windows is not None and source != "opencv":
+        raise ValueError("detection windows are only supported with the 'opencv' frame source")
+    stats = stats or DetectionStats()
+
+    def run(run_settings):
+        if source == "ffmpeg":
+            return _detect_ffmpeg(video_path, stride, run_settings, stats)
+
+        # Open video
+        keyframes = _index_keyframes(video_path, use_index)
+        cap = cv2.VideoCapture(video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        ranges = [(0, None)] if windows is None else _window_ranges(windows, fps, stride)
+        try:
+            return _detect_ranges(cap, fps, ranges, stride, run_settings, stats, keyframes)
+        finally:
+            cap.release()
+
+    # ffmpeg scales differently than OpenCV + ultralytics, so its boxes are cached separately
+    extra_key = {"source": source} if source != "opencv" else {}
+    if windows is not None:
+        extra_key["windows"] = [[round(start, 3), round(end, 3)] for start, end in sorted(windows)]
+    detections = _cached_detections(cache, video_path, settings, run, mode="fixed", stride=stride, **extra_key)
+    return _save_outputs(detections, detections_file, timestamps_file, stats, stats_file)
+
+
+def _refinement_windows(hit_frames, coarse_stride: int, interior_stride: int):
+    """
+    Turns the sorted frame indices of coarse hits into the frame ranges worth sampling again.
+    Consecutive coarse hits form one run. The frames between a run's first hit and the coarse sample
+    before it (onset) and between its last hit and the coarse sample after it (offset) are sampled
+    densely, to find where the kill starts and ends. Inside the run the kill is known to be on screen,
+    but its coarse hits are too far apart to be aggregated into one event, so the interior is sampled
+    every `interior_stride` frames like a fixed-stride run would.
+    Returns (edge_windows, interior_windows), both lists of (start_frame, end_frame).
+    """
+    runs = []  # [first_hit, last_hit] of every run of consecutive coarse hits
+    for frame_idx in hit_frames:
+        if runs and frame_idx - runs[-1][1] <= coarse_stride:
+            runs[-1][1] = frame_idx
+        else:
+            runs.append([frame_idx, frame_idx])
+
+    edges, interiors = [], []
+    for first_hit, last_hit in runs:
+        edges.append((max(first_hit - coarse_stride + 1, 0), first_hit))
+        edges.append((last_hit + 1, last_hit + coarse_stride))
+        interiors.append((first_hit + interior_stride, last_hit))
+    return ([(start, end) for start, end in edges if start < end],
+            [(start, end) for start, end in interiors if start < end])
+
+
+def detect_kills_adaptive(video_path: str, detections_file: str, coarse_interval: float = 1.5,
+                          fine_stride: int = 1, interior_stride: int = DEFAULT_STRIDE,
+                          settings: DetectionSettings = None, cache: DiskCache = None, stats: DetectionStats = None,
+                          timestamps_file: str = None, stats_file: str = None, use_index: bool = False):
+    """
+    Two-pass version of `detect_kills`. A coarse pass runs the detector once every `coarse_interval`
+    seconds, then a dense pass samples every `fine_stride`-th frame only around the edges of the
+    coarse hits, to recover the exact onset and offset of each kill, and every `interior_stride`-th
+    frame between them, so a kill's hits are as close together as in a `detect_kills` run with that
+    stride and aggregate into one event. The outputs have the same format as `detect_kills`.
+    `use_index` matters most here: the short refinement windows are reached by seeking, and the index
+    tells which of them share a GOP with the previous one.
+    """
+    settings = settings or DetectionSettings()
+    settings.validate(fine_stride)
+    if interior_stride < 1:
+        raise ValueError(f"interior_stride must be at least 1, got {interior_stride}")
+    stats = stats or DetectionStats()
+
+    def run(run_settings):
+        keyframes = _index_keyframes(video_path, use_index)
+        cap = cv2.VideoCapture(video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        coarse_stride = max(int(round(coarse_interval * fps)), fine_stride)
+        try:
+            # 1. Coarse pass over the whole video
+            coarse = _detect_ranges(cap, fps, [(0, None)], coarse_stride, run_settings, stats, keyframes)
+
+            # 2. Refine around the hits that pass the requested confidence, not the cache's lower floor
+            hit_frames = sorted({det[0] for det in coarse if det[3] >= settings.conf})
+            run_stride = min(interior_stride, coarse_stride)
+            edges, interiors = _refinement_windows(hit_frames, coarse_stride, run_stride)
+            fine = _detect_ranges(cap, fps, edges, fine_stride, run_settings, stats, keyframes)
+            interior = _detect_ranges(cap, fps, interiors, run_stride, run_settings, stats, keyframes)
+        finally:
+            cap.release()
+
+        # Interior samples can land on frames the coarse pass already detected
+        interior = [det for det in interior if det[0] % coarse_stride != 0]
+        print(f"Coarse pass: {len(hit_frames)} hit frames, refining {len(edges)} edges and {len(interiors)} runs")
+        return sorted(coarse + fine + interior, key=lambda det: det[0])
+
+    detections = _cached_detections(cache, video_path, settings, run, mode="adaptive", conf=settings.conf,
+                                    coarse_interval=coarse_interval, fine_stride=fine_stride,
+                                    interior_stride=interior_stride)
+    return _save_outputs(detections, detections_file, timestamps_file, stats, stats_file)
+
+
+def _init_shard_worker(num_threads: int):
+    """Splits the machine's cores between the shard processes instead of letting each one take all of them."""
+    import torch
+    torch.set_num_threads(num_threads)
+    cv2.setNumThreads(1)
+
+
+def _detect_shard(video_path: str, start_frame: int, end_frame: int, stride: int, settings: DetectionSettings,
+                  keyframes=None):
+    """
+    Runs in a worker process: detects kills in [start_frame, end_frame) with its own decoder and model.
+    Returns the detections together with the shard's DetectionStats.
+    """
+    stats = DetectionStats()
     cap = cv2.VideoCapture(video_path)
     fps = cap.get(cv2.CAP_PROP_FPS)
-    frame_count = 0
-
-    # Process only every 30th frame and skip the rest
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        # Process only every 30th frame
-        if frame_count % 5 == 0:
-            # Run inference on the current frame (detection only on every 30th frame)
-            results = model(frame)  # Detection only on every 30th frame
-
-            # Check if detections exist and log timestamps for each "kill"
-            boxes = results[0].boxes  # Assuming the result is a list of detections
-
-            for box in boxes:
-                cls = int(box.cls[0])  # Class of the detected object (you can refine this if needed)
-                timestamp = frame_count / fps  # Derive timestamp based on frame count and FPS
-                timestamps.append(timestamp)
-
-        frame_count += 1
-
-    cap.release()
-
-    # Save timestamps to a file for later use
-    with open(timestamps_file, "w") as f:
-        for ts in timestamps:
-            f.write(f"{ts}\n")
-
-    print(f"Detected kill timestamps saved to '{timestamps_file}'")
-    return timestamps
+    try:
+        return _detect_ranges(cap, fps, [(start_frame, end_frame)], stride, settings, stats, keyframes), stats
+    finally:
+        cap.release()
+
+
+def _shard_ranges(frame_count: int, num_shards: int, stride: int, overlap_frames: int):
+    """
+    Splits [0, frame_count) into `num_shards` owned ranges aligned to the sampling grid, and widens
+    each of them by `overlap_frames` (also grid aligned) on both sides.
+    Returns a list of (owned_start, owned_end, decode_start, decode_end). The last shard is open ended
+    (None) because the frame count reported by the container is only an estimate.
+    """
+    if frame_count <= 0:
+        return [(0, None, 0, None)]
+    shard_len = -(-frame_count // num_shards)  # Ceiling division
+    shard_len = -(-shard_len // stride) * stride
+    overlap_frames = -(-overlap_frames // stride) * stride
+
+    shards = []
+    for owned_start in range(0, frame_count, shard_len):
+        owned_end = owned_start + shard_len
+        if owned_end >= frame_count:
+            shards.append((owned_start, None, max(owned_start - overlap_frames, 0), None))
+        else:
+            shards.append((owned_start, owned_end,
+                           max(owned_start - overlap_frames, 0), owned_end + overlap_frames))
+    return shards
+
+
+def detect_kills_sharded(video_path: str, detections_file: str, num_processes: int = None,
+                         stride: int = DEFAULT_STRIDE, overlap: float = DEFAULT_SHARD_OVERLAP,
+                         settings: DetectionSettings = None, cache: DiskCache = None, stats: DetectionStats = None,
+                         timestamps_file: str = None, stats_file: str = None, use_index: bool = False):
+    """
+    Multi-process version of `detect_kills`: the video is split into `num_processes` time ranges that
+    overlap by `overlap` seconds, and each range is detected in its own process with its own decoder
+    and model. Frames in the overlaps are detected twice and only kept from the shard that owns them,
+    so the output is the same as a single-process run (and shares its cache entries). With
+    `use_index=True` the keyframe index is loaded once and handed to every shard.
+
+    With a `gate_threshold`, every shard's frame-difference gate starts over at its own first frame,
+    so the frames it reuses detections for can differ from a single-process run near the shard
+    boundaries. Such runs are cached apart from `detect_kills`, per number of processes and overlap.
+    """
+    if num_processes is None:
+        num_processes = max((os.cpu_count() or 1) // 4, 1)
+    if num_processes < 1:
+        raise ValueError(f"num_processes must be at least 1, got {num_processes}")
+    # Every shard decodes and infers on its own, without pipelining
+    settings = copy.copy(settings or DetectionSettings())
+    settings.pipelined, settings.num_workers = False, 1
+    settings.validate(stride)
+    stats = stats or DetectionStats()
+
+    def run(run_settings):
+        cap = cv2.VideoCapture(video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        keyframes = _index_keyframes(video_path, use_index)
+
+        shards = _shard_ranges(frame_count, num_processes, stride, int(round(overlap * fps)))
+        threads_per_process = max((os.cpu_count() or 1) // len(shards), 1)
+        with ProcessPoolExecutor(max_workers=len(shards), initializer=_init_shard_worker,
+                                 initargs=(threads_per_process,)) as executor:
+            futures = [executor.submit(_detect_shard, video_path, decode_start, decode_end, stride, run_settings,
+                                       keyframes)
+                       for _, _, decode_start, decode_end in shards]
+
+            # Merge in shard order, dropping the duplicate frames each shard decoded past its boundaries
+            detections = []
+            for (owned_start, owned_end, _, _), future in zip(shards, futures):
+                shard_detections, shard_stats = future.result()
+                detections.extend(det for det in shard_detections
+                                  if owned_start <= det[0] and (owned_end is None or det[0] < owned_end))
+                stats.merge(shard_stats)
+        print(f"Detected kills in {len(shards)} shards")
+        return detections
+
+    # The gate state of a shard depends on where it starts, gated shards do not match a single pass
+    extra_key = {}
+    if settings.gate_threshold is not None:
+        extra_key = {"shards": num_processes, "overlap": round(overlap, 3)}
+    detections = _cached_detections(cache, video_path, settings, run, mode="fixed", stride=stride, **extra_key)
+    return _save_outputs(detections, detections_file, timestamps_file, stats, stats_file)
+
+
+def _list_segments(source: str):
+    """The recording segments of `source`: the file itself, or the video files of a directory in name order."""
+    if not os.path.isdir(source):
+        return [source]
+    paths = glob.glob(os.path.join(source, "*"))
+    return sorted(p for p in paths if os.path.splitext(p)[1].lower() in SEGMENT_EXTENSIONS)
+
+
+def _load_checkpoint(checkpoint_file: str) -> dict:
+    if os.path.exists(checkpoint_file):
+        with open(checkpoint_file, "r") as f:
+            return json.load(f)
+    return {"segment": None, "next_frame": 0, "frame_offset": 0, "time_offset": 0.0, "fps": None}
+
+
+def _save_checkpoint(checkpoint_file: str, checkpoint: dict):
+    tmp_path = checkpoint_file + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, checkpoint_file)
+
+
+def detect_kills_follow(source: str, detections_file: str, stride: int = DEFAULT_STRIDE,
+                        poll_interval: float = FOLLOW_POLL_INTERVAL, idle_timeout: float = FOLLOW_IDLE_TIMEOUT,
+                        settings: DetectionSettings = None, stats: DetectionStats = None,
+                        timestamps_file: str = None, stats_file: str = None):
+    """
+    Follow mode of `detect_kills` for a recording that is still being written. `source` is either a
+    growing video file (record to MKV/TS, a plain MP4 is not readable before it is finalized) or a
+    directory of split recording segments.
+
+    Every `poll_interval` seconds the new frames are detected and appended to `detections_file` (and
+    `timestamps_file`), and the position reached is saved to `<detections_file>.checkpoint.json`, so a
+    restarted run resumes where the previous one stopped. Frame indices and timestamps continue across
+    segments. Returns the detections array once nothing has changed for `idle_timeout` seconds.
+    """
+    # Each poll only decodes a few seconds of new frames, not worth a pipeline
+    settings = copy.copy(settings or DetectionSettings())
+    settings.pipelined, settings.num_workers = False, 1
+    settings.validate(stride)
+    stats = stats or DetectionStats()
+
+    checkpoint_file = detections_file + ".checkpoint.json"
+    checkpoint = _load_checkpoint(checkpoint_file)
+    detections = []
+    if os.path.exists(detections_file) and checkpoint["segment"] is not None:
+        # Drop anything saved past the checkpoint, it is detected again below
+        resume_time = checkpoint["time_offset"] + checkpoint["next_frame"] / checkpoint["fps"]
+        detections = [det for det in to_tuples(load_detections(detections_file, mmap=False)) if det[1] < resume_time]
+        print(f"Resuming '{source}' from {resume_time:.2f}s")
+
+    last_change = time.monotonic()
+    last_sizes = {}
+    while True:
+        segments = _list_segments(source)
+        sizes = {path: os.path.getsize(path) for path in segments if os.path.exists(path)}
+        if sizes != last_sizes:
+            last_sizes = sizes
+            last_change = time.monotonic()
+        idle = time.monotonic() - last_change >= idle_timeout
+
+        # Segments before the checkpointed one are done, start with the checkpointed one
+        names = [os.path.basename(path) for path in segments]
+        current = names.index(checkpoint["segment"]) if checkpoint["segment"] in names else 0
+        for segment_idx in range(current, len(segments)):
+            name = names[segment_idx]
+            if checkpoint["segment"] != name:
+                checkpoint.update(segment=name, next_frame=0)
+
+            cap = cv2.VideoCapture(segments[segment_idx])
+            fps = cap.get(cv2.CAP_PROP_FPS) or checkpoint["fps"] or 30.0
+            try:
+                frames = _iter_sampled_frames(cap, stride, checkpoint["next_frame"])
+                new = _detect_frames(frames, fps, stride, settings, stats)
+                position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+                frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            finally:
+                cap.release()
+
+            # Shift into whole-recording frame indices and timestamps
+            detections.extend((det[0] + checkpoint["frame_offset"], det[1] + checkpoint["time_offset"], *det[2:])
+                              for det in new)
+            checkpoint["next_frame"] = max(-(-position // stride) * stride, checkpoint["next_frame"])
+            checkpoint["fps"] = fps
+
+            # A segment is finished once a later one exists, continue the timeline in the next one
+            if segment_idx < len(segments) - 1:
+                segment_frames = frame_count if frame_count > 0 else position
+                checkpoint["frame_offset"] += segment_frames
+                checkpoint["time_offset"] += segment_frames / fps
+                checkpoint.update(segment=names[segment_idx + 1], next_frame=0)
+
+        # Persist the detections before the checkpoint, so a crash in between only repeats work
+        _save_outputs(detections, detections_file, timestamps_file, stats, stats_file)
+        _save_checkpoint(checkpoint_file, checkpoint)
+
+        if idle:
+            print(f"'{source}' stopped growing, follow mode finished")
+            return to_array(detections)
+        time.sleep(poll_interval)
+
+
+def _list_videos(source: str):
+    """The videos matched by `source`: every video file of a directory, or the files matching a glob pattern."""
+    if os.path.isdir(source):
+        return _list_segments(source)
+    return sorted(glob.glob(source))
+
+
+class _BatchVideo:
+    """Bookkeeping for one video of a batch run, shared by its decoder thread and the inference workers."""
+    def __init__(self, video_path: str, detections_file: str, cache_key: str = None):
+        self.video_path = video_path
+        self.detections_file = detections_file
+        self.cache_key = cache_key
+        self.fps = None
+        self.detections = []
+        self.carried = []  # (gated frame index, frame index whose detections it reuses)
+        self.stats = DetectionStats()
+        self.pending = 0  # Sampled frames queued for inference but not inferred yet
+        self.decoded = False  # Set once the decoder reached the end of the video
+
+
+def detect_kills_batch(source: str, output_dir: str = ".", stride: int = DEFAULT_STRIDE,
+                       num_decoders: int = DEFAULT_BATCH_DECODERS, settings: DetectionSettings = None,
+                       cache: DiskCache = None, stats: DetectionStats = None, stats_file: str = None) -> dict:
+    """
+    Runs `detect_kills` on every VOD matched by `source` (a directory or a glob pattern) and saves the
+    detections of each one to `<output_dir>/<video name>_detections.npy`.
+
+    `num_decoders` videos are decoded at a time, each on its own thread, and their sampled frames are
+    mixed into shared batches for the `settings.num_workers` inference workers that each keep one model
+    loaded for the whole run. Videos whose detections file already exists are skipped, and since detections files
+    are written atomically, re-running after a crash picks up with the videos that were not finished.
+
+    Returns {video path: detections file} for every matched video.
+    """
+    settings = settings or DetectionSettings()
+    settings.validate(stride)
+    if num_decoders < 1:
+        raise ValueError(f"num_decoders must be at least 1, got {num_decoders}")
+    stats = stats or DetectionStats()
+    run_settings = _raw_settings(settings) if cache is not None else settings
+    os.makedirs(output_dir, exist_ok=True)
+
+    # 1. Resume: skip finished videos, and answer what we can from the cache
+    outputs, videos = {}, []
+    for video_path in _list_videos(source):
+        detections_file = os.path.join(output_dir, detections_path(video_path))
+        outputs[video_path] = detections_file
+        if os.path.exists(detections_file):
+            print(f"Skipping '{video_path}', '{detections_file}' already exists")
+            continue
+        key = _detection_cache_key(video_path, settings, mode="fixed", stride=stride) if cache is not None else None
+        cached_path = cache.get(key, ".npy") if cache is not None else None
+        if cached_path is not None:
+            print(f"Using cached detections for '{video_path}'")
+            detections = to_tuples(load_detections(cached_path, mmap=False))
+            _save_outputs([det for det in detections if det[3] >= settings.conf], detections_file)
+            continue
+        videos.append(_BatchVideo(video_path, detections_file, key))
+    if not videos:
+        print(f"Nothing left to detect in '{source}'")
+        return outputs
+
+    todo = queue.Queue()
+    for video in videos:
+        todo.put(video)
+    lock = threading.Lock()
+
+    def finish(video):
+        # Called exactly once per video, after its last sampled frame went through the model
+        detections = sorted(video.detections, key=lambda det: det[0])
+        if video.carried:
+            detections = _carry_forward(detections, video.carried, video.fps)
+        if video.cache_key is not None:
+            _store_detections(cache, video.cache_key, detections)
+        _save_outputs([det for det in detections if det[3] >= settings.conf], video.detections_file)
+
+    def decode(put):
+        while True:
+            try:
+                video = todo.get_nowait()
+            except queue.Empty:
+                return
+            cap = cv2.VideoCapture(video.video_path)
+            video.fps = cap.get(cv2.CAP_PROP_FPS)
+            try:
+                sampled = _timed_frames(_iter_sampled_frames(cap, stride), video.stats)
+                for frame_idx, frame in _gate_frames(sampled, stride, run_settings, video.carried, video.stats):
+                    with lock:
+                        video.pending += 1
+                    if not put((video, frame_idx, frame)):
+                        return
+            finally:
+                cap.release()
+            with lock:
+                video.decoded = True
+                done = video.pending == 0
+            if done:
+                finish(video)
+
+    def infer(worker_model, batch):
+        # Batches mix frames of every video being decoded, positions in the batch stand in for frame
+        # indices and the detections are mapped back below
+        found = _infer_batch([(pos, frame) for pos, (_, _, frame) in enumerate(batch)], 1.0, run_settings,
+                             worker_model, stats)
+        finished = []
+        with lock:
+            for pos, _, cls, box_conf, *box in found:
+                video, frame_idx, _ = batch[pos]
+                video.detections.append((frame_idx, frame_idx / video.fps, cls, box_conf, *box))
+            for video, _, _ in batch:
+                video.pending -= 1
+                if video.decoded and video.pending == 0:
+                    finished.append(video)
+        for video in finished:
+            finish(video)
+
+    # 2. Decode several videos at once into shared batches for the warm models
+    worker_models = [_get_model(run_settings, slot) for slot in range(settings.num_workers)]
+    start = time.perf_counter()
+    try:
+        _run_workers([decode] * num_decoders, infer, worker_models, settings.queue_size * settings.batch_size,
+                     max_items=settings.batch_size)
+    finally:
+        for video in videos:
+            stats.merge(video.stats)
+        stats.wall_time += time.perf_counter() - start
+    print(f"Detected kills in {len(videos)} videos ({stats.effective_fps:.1f} sampled frames/s)")
+    if stats_file:
+        stats.write_json(stats_file)
+        print(f"Detection stats saved to '{stats_file}'")
+    return outputs
@@ -0,0 +1,92 @@
+import os
+import numpy as np
+
+# One record per detected box. Stored as a plain .npy file so large VODs can be memory-mapped.
+DETECTION_DTYPE = np.dtype([
+    ("frame", "<i8"),        # index of the frame the box was found in
+    ("time", "<f8"),         # timestamp of that frame, in seconds
+    ("cls", "<i4"),          # detected class id
+    ("conf", "<f4"),         # detection confidence
+    ("box", "<f4", (4,)),    # x1, y1, x2, y2 in full-frame pixels
+])
+DETECTIONS_SUFFIX = "_detections.npy"
+
+
+def detections_path(video_path: str) -> str:
+    """Default detections file for a video: `<video name>_detections.npy` in the working directory."""
+    return os.path.splitext(os.path.basename(video_path))[0] + DETECTIONS_SUFFIX
+
+
+def to_array(detections) -> np.ndarray:
+    """Converts (frame, time, class, confidence, x1, y1, x2, y2) tuples into a detections array."""
+    array = np.zeros(len(detections), dtype=DETECTION_DTYPE)
+    if len(detections):
+        rows = np.asarray(detections, dtype=np.float64).reshape(-1, 8)
+        array["frame"] = rows[:, 0]
+        array["time"] = rows[:, 1]
+        array["cls"] = rows[:, 2]
+        array["conf"] = rows[:, 3]
+        array["box"] = rows[:, 4:]
+    return array
+
+
+def to_tuples(array: np.ndarray):
+    """Inverse of `to_array`."""
+    return [(int(frame), float(time), int(cls), float(conf), *map(float, box))
+            for frame, time, cls, conf, box in zip(array["frame"], array["time"], array["cls"],
+                                                   array["conf"], array["box"])]
+
+
+def write_detections(f, array: np.ndarray):
+    """Writes a detections array to an open binary file."""
+    np.save(f, np.ascontiguousarray(array, dtype=DETECTION_DTYPE), allow_pickle=False)
+
+
+def save_detections(path: str, array: np.ndarray):
+    """Writes a detections array to `path`, atomically so readers never see a half written file."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write_detections(f, array)
+    os.replace(tmp_path, path)
+
+
+def load_detections(path: str, mmap: bool = True) -> np.ndarray:
+    """Loads a detections array, memory-mapped (read only) by default."""
+    array = np.load(path, mmap_mode="r" if mmap else None, allow_pickle=False)
+    if array.dtype != DETECTION_DTYPE:
+        raise ValueError(f"'{path}' is not a detections file (dtype {array.dtype})")
+    return array
+
+
+def load_detections_file(path: str) -> np.ndarray:
+    """
+    Loads a detections file (.npy), or converts a legacy text timestamps file into a detections array
+    with unknown frame indices (-1), class 0 and confidence 1.
+    """
+    if path.endswith(".npy"):
+        return load_detections(path)
+    timestamps = load_timestamps(path)
+    array = np.zeros(len(timestamps), dtype=DETECTION_DTYPE)
+    array["frame"] = -1
+    array["time"] = timestamps
+    array["conf"] = 1.0
+    return array
+
+
+def save_timestamps(path: str, array: np.ndarray):
+    """Optional text export: one timestamp (in seconds) per detected box, as older versions wrote."""
+    with open(path, "w") as f:
+        for ts in array["time"]:
+            f.write(f"{ts}\n")
+
+
+def load_timestamps(path: str) -> np.ndarray:
+    """
+    Returns the sorted detection timestamps of a detections file (.npy) or of a text timestamps file,
+    with one entry per detected box.
+    """
+    if path.endswith(".npy"):
+        return np.sort(load_detections(path)["time"])
+    with open(path, "r") as f:
+        # Each line should be a float, e.g. "12.34\n"
+        return np.sort(np.array([float(line.strip()) for line in f if line.strip()], dtype=np.float64))
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+# Bytes read from the start, the middle and the end of a file to fingerprint it
+FINGERPRINT_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def file_fingerprint(path: str) -> str:
+    """
+    Cheap content fingerprint of a (possibly multi-GB) video: its size plus a hash of chunks taken from
+    its start, middle and end. Renaming or copying the file keeps the fingerprint, re-encoding it does not.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(str(size).encode())
+    offsets = {0, max(size // 2 - FINGERPRINT_CHUNK_SIZE // 2, 0), max(size - FINGERPRINT_CHUNK_SIZE, 0)}
+    with open(path, "rb") as f:
+        for offset in sorted(offsets):
+            f.seek(offset)
+            digest.update(f.read(FINGERPRINT_CHUNK_SIZE))
+    return digest.hexdigest()
+
+
+def file_hash(path: str) -> str:
+    """SHA-256 of the whole file, for small files such as model weights."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(src: str, dst: str):
+    """Hardlinks `src` to `dst` (replacing it), or copies it where hardlinks are not possible (e.g. across drives)."""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def make_key(**parts) -> str:
+    """Turns JSON-serializable key parts into a stable cache key."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+class DiskCache:
+    """
+    A directory holding one file per cache key. Once the files take more than `max_bytes`, the least
+    recently used ones are deleted. Every hit refreshes the file's modification time, which is what
+    the LRU order is based on.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def path(self, key: str, suffix: str = "") -> str:
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def get(self, key: str, suffix: str = ""):
+        """Returns the path of the cached file for `key`, or None on a miss."""
+        path = self.path(key, suffix)
+        if not os.path.isfile(path):
+            return None
+        os.utime(path)  # Mark as recently used
+        return path
+
+    def put(self, key: str, write, suffix: str = "") -> str:
+        """
+        Stores a new entry: `write(tmp_path)` must create the file, which is then moved into place
+        atomically so that an interrupted write never leaves a truncated entry behind.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            write(tmp_path)
+            path = self.path(key, suffix)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep: str = None):
+        """Deletes least recently used entries until the cache fits in `max_bytes`."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if os.path.isfile(path) and not name.endswith(".tmp"):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            os.remove(path)
+            total -= size
@@ -1,82 +1,253 @@
+import glob
 import os
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.util import Finalize
 from moviepy.editor import VideoFileClip
+from clip_manifest import remove_manifest, write_manifest
+from detections_io import load_detections_file
+from disk_cache import DiskCache, file_fingerprint, link_or_copy, make_key
+from kill_events import aggregate_kill_events, DEFAULT_MIN_HITS
+from smart_cut import (AUDIO_BITRATE, HEAD_CRF, HEAD_ENCODERS, cut_clips_single_pass, keyframe_times,
+                       probe_source, smart_cut)
 
-def extract_kill_clips(video_path: str,
-                                  timestamps_file: str,
-                                  buffer_duration: float = 0.5,
-                                  max_gap: float = 0.5):
-    """
-    Extracts short clips (including audio) from `video_path` based on kill timestamps.
-    Each group of timestamps that are within `max_gap` seconds of each other becomes one clip,
-    with an extra `buffer_duration` added before the first timestamp and after the last timestamp.
-    """
-    # 1. Prepare output folder
-    output_dir = "kill_clips"
-    os.makedirs(output_dir, exist_ok=True)
+# "reencode" writes every clip through moviepy (libx264 + aac), "smartcut" stream-copies everything
+# after the first keyframe of each clip and only re-encodes the frames before it, and "singlepass"
+# decodes the source once and encodes every clip from that one pass (see smart_cut.py). "manifest"
+# encodes nothing and only describes the clips as ranges of the source (see clip_manifest.py).
+CLIP_MODES = ("reencode", "smartcut", "singlepass", "manifest")
+# Threads every clip encoder may use. Clips are encoded side by side in worker processes instead of
+# one at a time with every core, which scales much better for short clips.
+ENCODER_THREADS = 2
 
-    # 2. Read all timestamps (in seconds) from the file
-    with open(timestamps_file, "r") as f:
-        # Each line should be a float, e.g. "12.34\n"
-        timestamps = [float(line.strip()) for line in f if line.strip()]
+# Encoded clips kept for re-extraction, keyed by source content, time range and encode settings
+CLIP_CACHE_DIR = ".clip_cache"
+CLIP_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+_worker = {}  # Per-process export state, set up by `_init_export_worker`
+
+
+def default_clip_workers() -> int:
+    """One export worker per `ENCODER_THREADS` physical cores."""
+    try:
+        import psutil
+        cores = psutil.cpu_count(logical=False)
+    except ImportError:
+        cores = None
+    cores = cores or max((os.cpu_count() or 2) // 2, 1)  # Without psutil, assume 2 threads per core
+    return max(cores // ENCODER_THREADS, 1)
 
-    if not timestamps:
-        print("No timestamps found, exiting.")
-        return []
 
-    timestamps.sort()
-    
-    # 3. Group timestamps that are within max_gap of each other
-    grouped_timestamps = []
-    current_group = [timestamps[0]]
-
-    for t in timestamps[1:]:
-        if t - current_group[-1] <= max_gap:
-            current_group.append(t)
-        else:
-            grouped_timestamps.append(current_group)
-            current_group = [t]
-    grouped_timestamps.append(current_group)
-
-    # 4. Load the full video once
-    video = VideoFileClip(video_path)
-    video_duration = video.duration  # in seconds
-
-    clip_paths = []
-    for idx, group in enumerate(grouped_timestamps):
-        start_time = max(min(group) - buffer_duration, 0)
-        end_time = min(max(group), video_duration)
+def _close_worker_video():
+    video = _worker.pop("video", None)
+    if video is not None:
+        video.reader.close()
+        if video.audio is not None:
+            video.audio.reader.close_proc()
+
+
+def _init_export_worker(video_path: str, mode: str, progress, total: int, info: dict = None, keyframes=None):
+    """Opens this worker's own reader of the source video (or keeps its probed keyframes for smart cuts)."""
+    _worker.update(video_path=video_path, mode=mode, progress=progress, total=total, info=info, keyframes=keyframes)
+    if mode == "reencode":
+        _worker["video"] = VideoFileClip(video_path)
+        # Worker processes skip atexit handlers, this runs when the worker shuts down
+        Finalize(None, _close_worker_video, exitpriority=10)
+
+
+def _export_clip(idx: int, start_time: float, end_time: float, output_clip_path: str) -> str:
+    """Writes clip #`idx` ([start_time, end_time) of the source) in a worker and reports progress."""
+    if _worker["mode"] == "smartcut":
+        info = _worker["info"]
+        end_time = min(end_time, info["duration"]) if info["duration"] else end_time
+        smart_cut(_worker["video_path"], start_time, end_time, output_clip_path, _worker["keyframes"], info,
+                  threads=ENCODER_THREADS)
+    else:
+        video = _worker["video"]
+        end_time = min(end_time, video.duration)
 
         # MoviePy’s subclip uses (t_start, t_end) in seconds
         subclip = video.subclip(start_time, end_time)
 
-        output_clip_path = os.path.join(output_dir, f"kill{idx+1}.mp4")
-        # Write out the clip with both video + audio
+        # Write out the clip with both video + audio, every worker needs its own temp audio file
         # You can tweak bitrate/fps/etc. if needed; this is a reasonable default
         subclip.write_videofile(
             output_clip_path,
             codec="libx264",
             audio_codec="aac",
-            temp_audiofile="temp-audio.m4a",
+            temp_audiofile=os.path.splitext(output_clip_path)[0] + "-temp-audio.m4a",
             remove_temp=True,
             fps=video.fps,
+            threads=ENCODER_THREADS,
             verbose=False,
             logger=None
         )
-        
-        print(f"Saved clip #{idx+1}: {output_clip_path}")
-        clip_paths.append(output_clip_path)
 
-    video.reader.close()
-    video.audio.reader.close_proc()
-    return clip_paths
+    progress = _worker["progress"]
+    with progress.get_lock():
+        progress.value += 1
+        done = progress.value
+    print(f"[{done}/{_worker['total']}] Saved clip #{idx+1}: {output_clip_path}")
+    return output_clip_path
+
+
+def extract_kill_clips(video_path: str,
+                                  detections_file: str,
+                                  buffer_duration: float = 0.5,
+                                  max_gap: float = 0.5,
+                                  min_hits: int = DEFAULT_MIN_HITS,
+                                  class_gaps: dict = None,
+                                  mode: str = "reencode",
+                                  num_workers: int = None,
+                                  cache: DiskCache = None):
+    """
+    Extracts short clips (including audio) from `video_path` based on kill detections.
+    `detections_file` is either a detections file written by `detect_kills` or a text file with one
+    timestamp per line.
+    The detections are aggregated into kill events first (see kill_events.py): hits that are within
+    `max_gap` seconds of each other (or `class_gaps[cls]` for a class) become one event, events with
+    fewer than `min_hits` hits are dropped, and each remaining event becomes one clip with an extra
+    `buffer_duration` added before its onset.
+
+    `mode="smartcut"` keeps the source video quality and is several times faster for short clips,
+    since only the frames before each clip's first keyframe are re-encoded. `mode="singlepass"` reads
+    the source exactly once for all clips, which pays off when kills are close together.
+    `mode="manifest"` writes `kill_clips/manifest.json` with the source range of every clip instead of
+    encoding them, the montage then reads the frames from the source directly, and the clip entries
+    are returned instead of paths.
+
+    Clips are exported by `num_workers` processes (see `default_clip_workers`), each with its own reader
+    of the source video. Clip names follow the event order (`kill1.mp4`, `kill2.mp4`, ...) regardless of
+    which clip finishes first.
+
+    With a `cache` (see `CLIP_CACHE_DIR`), clips whose source range and encode settings are unchanged
+    are hardlinked (or copied) from the cache and only new or changed ranges are encoded.
+    """
+    if mode not in CLIP_MODES:
+        raise ValueError(f"unknown clip mode '{mode}', expected one of {CLIP_MODES}")
+    num_workers = num_workers or default_clip_workers()
+
+    # 1. Prepare output folder
+    output_dir = "kill_clips"
+    os.makedirs(output_dir, exist_ok=True)
+
+    # 2. Read all detections from the file
+    detections = load_detections_file(detections_file)
+
+    # 3. Turn the raw hits into one event per kill
+    events = aggregate_kill_events(detections, max_gap=max_gap, class_gaps=class_gaps, min_hits=min_hits)
+
+    if not len(events):
+        print("No kill events found, exiting.")
+        return []
+
+    # 4. One clip per event, named by its position in the event list
+    clips = []
+    for idx, event in enumerate(events):
+        start_time = max(event["onset"] - buffer_duration, 0)
+        clips.append((idx, start_time, event["offset"], os.path.join(output_dir, f"kill{idx+1}.mp4")))
+
+    # The montage reads the manifest whenever there is one, and the clip files otherwise, so a folder
+    # must never hold the leftovers of the other kind of extraction
+    if mode == "manifest":
+        for old_clip_path in glob.glob(os.path.join(output_dir, "kill*.mp4")):
+            os.remove(old_clip_path)
+        info = probe_source(video_path)
+        windows = [(start_time, min(end_time, info["duration"]) if info["duration"] else end_time)
+                   for _, start_time, end_time, _ in clips]
+        manifest_clips = write_manifest(output_dir, video_path, windows, info)
+        print(f"Saved {len(manifest_clips)} virtual clips of '{video_path}' to the clip manifest")
+        return manifest_clips
+
+    remove_manifest(output_dir)
+
+    # 5. Reuse the clips whose source range and encode settings have not changed
+    keys, cached_paths = {}, {}
+    if cache is not None:
+        fingerprint = file_fingerprint(video_path)
+        for idx, start_time, end_time, output_clip_path in clips:
+            keys[idx] = make_key(source=fingerprint, start=round(float(start_time), 3), end=round(float(end_time), 3),
+                                 mode=mode, **_encode_settings(mode))
+            cached_path = cache.get(keys[idx], ".mp4")
+            if cached_path is not None:
+                link_or_copy(cached_path, output_clip_path)
+                cached_paths[idx] = output_clip_path
+        if cached_paths:
+            print(f"Reused {len(cached_paths)} of {len(clips)} clips from the clip cache")
+
+    # 6. Encode the rest, and keep them for next time
+    todo = [clip for clip in clips if clip[0] not in cached_paths]
+    for _, _, _, output_clip_path in todo:
+        # An old clip at this path may be hardlinked into the cache, writing over it in place would
+        # change that cache entry too, so encode into a fresh file
+        if os.path.lexists(output_clip_path):
+            os.remove(output_clip_path)
+    if todo:
+        _encode_clips(video_path, todo, mode, num_workers)
+    if cache is not None:
+        for idx, _, _, output_clip_path in todo:
+            cache.put(keys[idx], lambda tmp_path, path=output_clip_path: link_or_copy(path, tmp_path), ".mp4")
+    return [clip[3] for clip in clips]
+
+
+def _encode_settings(mode: str) -> dict:
+    """Everything besides the source range that changes the encoded clip, for the clip cache key."""
+    if mode == "reencode":
+        return {"codec": "libx264", "audio_codec": "aac"}
+    return {"encoders": HEAD_ENCODERS, "crf": HEAD_CRF, "audio_bitrate": AUDIO_BITRATE}
+
+
+def _encode_clips(video_path: str, clips, mode: str, num_workers: int):
+    """Encodes the (idx, start_time, end_time, output_clip_path) clips with the given clip mode."""
+    if mode == "singlepass":
+        # One ffmpeg run (with one encoder per clip) instead of a pool of workers
+        info = probe_source(video_path)
+        windows = [(start_time, min(end_time, info["duration"]) if info["duration"] else end_time)
+                   for _, start_time, end_time, _ in clips]
+        clip_paths = cut_clips_single_pass(video_path, windows, [clip[3] for clip in clips], info,
+                                           threads=ENCODER_THREADS)
+        print(f"Saved {len(clip_paths)} clips in a single pass over '{video_path}'")
+        return clip_paths
+
+    # Smart cuts need the source keyframes, probe them once for every worker
+    info = keyframes = None
+    if mode == "smartcut":
+        info = probe_source(video_path)
+        keyframes = keyframe_times(video_path)
+
+    # Export the clips in parallel, every worker opens its own reader
+    progress = multiprocessing.Value("i", 0)
+    initargs = (video_path, mode, progress, len(clips), info, keyframes)
+    num_workers = min(num_workers, len(clips))
+    if num_workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_export_worker,
+                                     initargs=initargs) as executor:
+                futures = [executor.submit(_export_clip, *clip) for clip in clips]
+                return [future.result() for future in futures]
+        except BrokenProcessPool:
+            # A frozen (PyInstaller) build whose entry point does not hand its workers over to
+            # multiprocessing cannot start them, export from this process instead
+            if not getattr(sys, "frozen", False):
+                raise
+            print("Could not start the clip export workers, exporting the clips in this process")
+            progress.value = 0
+
+    _init_export_worker(*initargs)
+    try:
+        return [_export_clip(*clip) for clip in clips]
+    finally:
+        _close_worker_video()
 
 
 if __name__ == "__main__":
     video_file = "valorant.mp4"       # replace with your actual video file path
-    timestamps_txt = "valorant_kill_timestamps.txt"    # replace with your timestamps file
+    detections_npy = "valorant_detections.npy"    # replace with your detections file
     extract_kill_clips(
         video_file,
-        timestamps_txt,
+        detections_npy,
         buffer_duration=0.5,
         max_gap=0.5
     )
@@ -0,0 +1,148 @@
+import collections
+import json
+import subprocess
+import threading
+import numpy as np
+
+# Longest side of the frames ffmpeg hands to the detector when scaling (the model's input size)
+INGEST_SIZE = 640
+# Last lines of ffmpeg's log kept for the error message (damaged recordings log one line per bad macroblock)
+STDERR_TAIL_LINES = 20
+
+
+def probe_video(video_path: str) -> dict:
+    """Width, height, FPS and (estimated) frame count of the first video stream, read with ffprobe."""
+    cmd = ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries",
+           "stream=width,height,avg_frame_rate,r_frame_rate,nb_frames", "-of", "json", video_path]
+    res = subprocess.run(cmd, capture_output=True, text=True)
+    streams = json.loads(res.stdout or "{}").get("streams") if res.returncode == 0 else None
+    if not streams:
+        raise ValueError(f"could not probe a video stream in '{video_path}': {res.stderr.strip()}")
+    stream = streams[0]
+
+    fps = 0.0
+    for rate in (stream.get("avg_frame_rate"), stream.get("r_frame_rate")):
+        num, _, den = (rate or "0/0").partition("/")
+        if float(num or 0) > 0 and float(den or 1) > 0:
+            fps = float(num) / float(den or 1)
+            break
+    frame_count = stream.get("nb_frames", "0")
+    return {"width": int(stream["width"]), "height": int(stream["height"]), "fps": fps,
+            "frame_count": int(frame_count) if frame_count.isdigit() else 0}
+
+
+def _drain_lines(stream, tail: collections.deque):
+    """Reads `stream` to its end, keeping only the last lines, so the writer never blocks on a full pipe."""
+    for line in iter(stream.readline, b""):
+        tail.append(line)
+
+
+def _read_exact(stream, view: memoryview) -> bool:
+    """Fills `view` from `stream`, pipes return partial reads. Returns False at end of stream."""
+    filled = 0
+    while filled < len(view):
+        n = stream.readinto(view[filled:])
+        if not n:
+            return False
+        filled += n
+    return True
+
+
+class FFmpegFrames:
+    """
+    Frame source that lets ffmpeg do the expensive work: frame selection (every `stride`-th frame of
+    [start_frame, end_frame)), cropping to `crop` (a (left, top, right, bottom) rectangle of fractions,
+    see `VALORANT_HUD_ROI`) and scaling so the longest side is `size`, all inside the decoder. The BGR
+    result is streamed as rawvideo through a pipe and read straight into a ring of `num_buffers`
+    preallocated arrays, so no frame is copied in Python.
+
+    Iterating yields (frame_index, frame) like `_iter_sampled_frames`. The yielded arrays are reused
+    once the ring wraps around, so consumers must be done with a frame `num_buffers` frames later.
+    Use `to_source_box` to map boxes found on these frames back to source pixel coordinates.
+    """
+    def __init__(self, video_path: str, stride: int = 1, start_frame: int = 0, end_frame: int = None,
+                 crop=None, size: int = None, num_buffers: int = 64):
+        if stride < 1:
+            raise ValueError(f"stride must be at least 1, got {stride}")
+        if num_buffers < 1:
+            raise ValueError(f"num_buffers must be at least 1, got {num_buffers}")
+        info = probe_video(video_path)
+        self.video_path = video_path
+        self.stride = stride
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.fps = info["fps"]
+
+        # Crop rectangle in source pixels, rounded the same way as `_crop_regions`
+        width, height = self.source_size = info["width"], info["height"]
+        left, top, right, bottom = crop or (0.0, 0.0, 1.0, 1.0)
+        self.x0, self.y0 = int(left * width), int(top * height)
+        self.crop_w = int(round(right * width)) - self.x0
+        self.crop_h = int(round(bottom * height)) - self.y0
+
+        # Output size, only ever scaled down
+        scale = min(size / max(self.crop_w, self.crop_h), 1.0) if size else 1.0
+        self.width = max(int(round(self.crop_w * scale)), 1)
+        self.height = max(int(round(self.crop_h * scale)), 1)
+
+        self.buffers = np.empty((num_buffers, self.height, self.width, 3), dtype=np.uint8)
+        self.process = None
+        self.stderr_thread = None
+        self.stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+
+    def _command(self):
+        filters = [f"select=not(mod(n\\,{self.stride}))"]
+        if (self.crop_w, self.crop_h) != self.source_size:
+            filters.append(f"crop={self.crop_w}:{self.crop_h}:{self.x0}:{self.y0}")
+        if (self.width, self.height) != (self.crop_w, self.crop_h):
+            filters.append(f"scale={self.width}:{self.height}:flags=area")
+
+        cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin"]
+        if self.start_frame > 0:
+            cmd += ["-ss", f"{self.start_frame / self.fps:.6f}"]
+        cmd += ["-i", self.video_path, "-an", "-sn", "-vf", ",".join(filters), "-vsync", "passthrough"]
+        if self.end_frame is not None:
+            cmd += ["-frames:v", str(max(-(-(self.end_frame - self.start_frame) // self.stride), 0))]
+        return cmd + ["-f", "rawvideo", "-pix_fmt", "bgr24", "-"]
+
+    def __iter__(self):
+        self.close()
+        self.process = subprocess.Popen(self._command(), stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+        # stderr is drained while the frames are read, a chatty ffmpeg would otherwise block on it and never
+        # write the next frame
+        self.stderr_tail.clear()
+        self.stderr_thread = threading.Thread(target=_drain_lines, args=(self.process.stderr, self.stderr_tail),
+                                              daemon=True)
+        self.stderr_thread.start()
+        try:
+            sample = 0
+            while True:
+                frame = self.buffers[sample % len(self.buffers)]
+                if not _read_exact(self.process.stdout, memoryview(frame).cast("B")):
+                    break
+                yield self.start_frame + sample * self.stride, frame
+                sample += 1
+            if self.process.wait() != 0:
+                self.stderr_thread.join()
+                raise RuntimeError(f"ffmpeg failed to decode '{self.video_path}': "
+                                   f"{b''.join(self.stderr_tail).decode(errors='replace').strip()}")
+        finally:
+            self.close()
+
+    def to_source_box(self, x1: float, y1: float, x2: float, y2: float):
+        """Maps a box on the cropped, scaled frames back to source frame pixels."""
+        scale_x, scale_y = self.crop_w / self.width, self.crop_h / self.height
+        return (x1 * scale_x + self.x0, y1 * scale_y + self.y0,
+                x2 * scale_x + self.x0, y2 * scale_y + self.y0)
+
+    def close(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.stderr_thread.join()
+        self.process.stdout.close()
+        self.process.stderr.close()
+        self.process = None
+        self.stderr_thread = None
@@ -0,0 +1,104 @@
+import numpy as np
+
+# One record per kill: when it appears and disappears, its class, mean confidence and number of hits
+KILL_EVENT_DTYPE = np.dtype([
+    ("onset", "<f8"),
+    ("offset", "<f8"),
+    ("cls", "<i4"),
+    ("score", "<f4"),
+    ("hits", "<i4"),
+])
+# Largest gap (in seconds) between two hits of the same kill
+DEFAULT_MAX_GAP = 0.5
+# Events with fewer hit frames than this are treated as false positives
+DEFAULT_MIN_HITS = 2
+# Events overlapping a higher scoring event by more than this temporal IoU are merged into it
+# (0 merges any events that overlap at all)
+DEFAULT_NMS_IOU = 0.0
+
+
+def _temporal_nms(events: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """
+    Greedy temporal NMS across classes: going from the highest score down, every event overlapping an
+    already kept event by more than `iou_threshold` is merged into it (its time span and hits are absorbed).
+    """
+    if len(events) < 2:
+        return events
+    onset, offset = events["onset"], events["offset"]
+    latest_onset = np.maximum(onset[:, None], onset[None, :])
+    earliest_offset = np.minimum(offset[:, None], offset[None, :])
+    overlapping = latest_onset <= earliest_offset
+    if iou_threshold > 0:
+        union = np.maximum(offset[:, None], offset[None, :]) - np.minimum(onset[:, None], onset[None, :])
+        iou = (earliest_offset - latest_onset) / np.where(union > 0, union, 1)
+        overlapping &= (iou > iou_threshold) | (union == 0)
+
+    kept = []
+    alive = np.ones(len(events), dtype=bool)
+    for idx in np.argsort(-events["score"], kind="stable"):
+        if not alive[idx]:
+            continue
+        group = alive & overlapping[idx]
+        group[idx] = True
+        alive &= ~group
+        event = events[idx].copy()
+        event["onset"] = onset[group].min()
+        event["offset"] = offset[group].max()
+        event["hits"] = events["hits"][group].sum()
+        kept.append(event)
+    return np.sort(np.array(kept, dtype=KILL_EVENT_DTYPE), order="onset")
+
+
+def aggregate_kill_events(detections: np.ndarray, max_gap: float = DEFAULT_MAX_GAP, class_gaps: dict = None,
+                          min_hits: int = DEFAULT_MIN_HITS, nms_iou: float = DEFAULT_NMS_IOU) -> np.ndarray:
+    """
+    Turns raw per-box detections (see detections_io.py) into kill events, vectorized over the whole array:
+
+    1. boxes of the same class in the same frame count as a single hit (with their best confidence),
+    2. hits of a class less than `max_gap` seconds apart (or `class_gaps[cls]` for that class) form one event,
+    3. events with fewer than `min_hits` hits are dropped,
+    4. temporal NMS merges overlapping events of different classes into the highest scoring one.
+
+    Returns a KILL_EVENT_DTYPE array sorted by onset, with the event score being the mean hit confidence.
+    """
+    if len(detections) == 0:
+        return np.zeros(0, dtype=KILL_EVENT_DTYPE)
+    times = np.asarray(detections["time"], dtype=np.float64)
+    classes = np.asarray(detections["cls"], dtype=np.int64)
+    confs = np.asarray(detections["conf"], dtype=np.float64)
+
+    # 1. One hit per (class, timestamp), keeping the most confident box
+    order = np.lexsort((-confs, times, classes))
+    times, classes, confs = times[order], classes[order], confs[order]
+    first = np.ones(len(times), dtype=bool)
+    first[1:] = (classes[1:] != classes[:-1]) | (times[1:] != times[:-1])
+    times, classes, confs = times[first], classes[first], confs[first]
+
+    # 2. Split every class's hits wherever the gap exceeds that class's limit
+    gaps = np.full(classes.max() + 1, max_gap, dtype=np.float64)
+    for cls, gap in (class_gaps or {}).items():
+        if 0 <= cls < len(gaps):
+            gaps[cls] = gap
+    starts_event = np.ones(len(times), dtype=bool)
+    starts_event[1:] = (classes[1:] != classes[:-1]) | (np.diff(times) > gaps[classes[1:]])
+    starts = np.flatnonzero(starts_event)
+
+    events = np.zeros(len(starts), dtype=KILL_EVENT_DTYPE)
+    events["onset"] = times[starts]
+    events["offset"] = np.maximum.reduceat(times, starts)
+    events["cls"] = classes[starts]
+    events["hits"] = np.diff(np.append(starts, len(times)))
+    events["score"] = np.add.reduceat(confs, starts) / events["hits"]
+
+    # 3. Drop one-off hits
+    events = events[events["hits"] >= min_hits]
+
+    # 4. Several classes firing for the same kill should still give one event
+    return _temporal_nms(np.sort(events, order="onset"), nms_iou)
+
+
+if __name__ == "__main__":
+    from detections_io import load_detections
+    for event in aggregate_kill_events(load_detections("valorant_detections.npy")):
+        print(f"kill at {event['onset']:.2f}s - {event['offset']:.2f}s (class {event['cls']}, "
+              f"score {event['score']:.2f}, {event['hits']} hits)")
@@ -1,10 +1,13 @@
+import multiprocessing
 import os
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from tkinter import ttk
 from threading import Thread
-from detect_kills import detect_kills
-from extract_clips import extract_kill_clips
+from detect_kills import detect_kills, DETECTION_CACHE_DIR, DETECTION_CACHE_MAX_BYTES
+from disk_cache import DiskCache
+from detections_io import detections_path
+from extract_clips import extract_kill_clips, CLIP_CACHE_DIR, CLIP_CACHE_MAX_BYTES
 from sync_and_generate_video import generate_final_montage
 import subprocess
 import sys
@@ -80,21 +83,24 @@ class VideoEditorGUI:
         # Initialize paths
         self.video_path = None
         self.music_path = None
-        self.timestamps_file = None  # We'll set this dynamically after video selection
+        self.detections_file = None  # We'll set this dynamically after video selection
         self.clip_folder = "kill_clips"
         self.output_path = None
+        # Repeated detections on the same video and weights are answered from this cache
+        self.detection_cache = DiskCache(DETECTION_CACHE_DIR, DETECTION_CACHE_MAX_BYTES)
+        # Clips are re-extracted from scratch, but unchanged ones come from this cache instead of being re-encoded
+        self.clip_cache = DiskCache(CLIP_CACHE_DIR, CLIP_CACHE_MAX_BYTES)
 
-        # Check if kill timestamps exist
-        self.check_timestamps_available()
+        # Check if kill detections exist
+        self.check_detections_available()
 
     def browse_video(self):
         self.video_path = filedialog.askopenfilename(filetypes=[("MP4 Files", "*.mp4")])
         if self.video_path:
             self.video_path_label.config(text=f"Video File: {self.video_path}")
-            # Set timestamps file name dynamically based on video file name
-            video_name = os.path.splitext(os.path.basename(self.video_path))[0]
-            self.timestamps_file = f"{video_name}_kill_timestamps.txt"
-            self.check_timestamps_available()
+            # Set detections file name dynamically based on video file name
+            self.detections_file = detections_path(self.video_path)
+            self.check_detections_available()
 
     def browse_music(self):
         self.music_path = filedialog.askopenfilename(filetypes=[("MP3 Files", "*.mp3")])
@@ -110,15 +116,15 @@ class VideoEditorGUI:
     def update_status(self, message):
         self.status_label.config(text=f"Status: {message}")
 
-    def check_timestamps_available(self):
-        """Check if the timestamps file exists and update status."""
-        if self.timestamps_file and os.path.exists(self.timestamps_file):
-            self.update_status(f"Kill timestamps found: {self.timestamps_file}")
+    def check_detections_available(self):
+        """Check if the detections file exists and update status."""
+        if self.detections_file and os.path.exists(self.detections_file):
+            self.update_status(f"Kill detections found: {self.detections_file}")
         else:
-            self.update_status("No kill timestamps found. Please run 'Detect Kills'.")
+            self.update_status("No kill detections found. Please run 'Detect Kills'.")
 
     def reset_files_and_folders(self):
-        """Resets the clips folder but keeps the timestamps file intact."""
+        """Resets the clips folder but keeps the detections file intact."""
         # Delete the existing clips folder if it exists
         if os.path.exists(self.clip_folder):
             for file in os.listdir(self.clip_folder):
@@ -140,9 +146,9 @@ class VideoEditorGUI:
         # Run kill detection in a separate thread
         def run_detection():
             try:
-                detect_kills(self.video_path, self.timestamps_file)
+                detect_kills(self.video_path, self.detections_file, cache=self.detection_cache)
                 self.update_status("Kills detected successfully!")
-                self.check_timestamps_available()
+                self.check_detections_available()
             except Exception as e:
                 self.update_status(f"Error: {e}")
             finally:
@@ -154,8 +160,8 @@ class VideoEditorGUI:
         if not self.video_path:
             messagebox.showerror("Error", "Please select a video file.")
             return
-        if not os.path.exists(self.timestamps_file):
-            messagebox.showerror("Error", "No kill timestamps found. Run 'Detect Kills' first.")
+        if not os.path.exists(self.detections_file):
+            messagebox.showerror("Error", "No kill detections found. Run 'Detect Kills' first.")
 
         # Delete existing kill clips folder to reset the clips
         self.reset_files_and_folders()
@@ -167,7 +173,7 @@ class VideoEditorGUI:
         # Run clip extraction in a separate thread
         def run_extraction():
             try:
-                clip_paths = extract_kill_clips(self.video_path, self.timestamps_file)
+                clip_paths = extract_kill_clips(self.video_path, self.detections_file, cache=self.clip_cache)
                 self.update_status(f"Extracted {len(clip_paths)} kill clips successfully!")
             except Exception as e:
                 self.update_status(f"Error: {e}")
@@ -218,4 +224,7 @@ def main():
     root.mainloop()
 
 if __name__ == "__main__":
+    # Clips are exported by worker processes, which a frozen (PyInstaller) build must start here
+    # instead of opening another GUI
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,188 @@
+import os
+import cv2
+import numpy as np
+
+# Inference backends the kill detector can run on. "onnx" runs through ONNX Runtime and "openvino"
+# through OpenVINO, both load through ultralytics so pre- and post-processing stay identical.
+BACKENDS = ("torch", "onnx", "openvino")
+# Dataset used to calibrate OpenVINO int8 quantization (the frames the model was trained on)
+CALIBRATION_DATA = "data/data.yaml"
+# Number of video frames used to calibrate ONNX int8 quantization
+CALIBRATION_FRAMES = 64
+# Input size the model was trained with (see train.py)
+IMAGE_SIZE = 640
+
+
+def backend_model_path(weights_path: str, backend: str, int8: bool = False) -> str:
+    """Where the exported model for `backend` lives: next to the .pt weights, named like ultralytics does."""
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown backend '{backend}', expected one of {BACKENDS}")
+    stem = os.path.splitext(weights_path)[0]
+    if backend == "torch":
+        return weights_path
+    if backend == "onnx":
+        return stem + ("_int8.onnx" if int8 else ".onnx")
+    return stem + ("_int8_openvino_model" if int8 else "_openvino_model")
+
+
+def _letterbox(frame, size: int = IMAGE_SIZE):
+    """Same resize + gray padding + RGB/CHW/[0, 1] conversion ultralytics applies before inference."""
+    height, width = frame.shape[:2]
+    scale = min(size / height, size / width)
+    new_w, new_h = int(round(width * scale)), int(round(height * scale))
+    resized = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, left = (size - new_h) // 2, (size - new_w) // 2
+    padded = cv2.copyMakeBorder(resized, top, size - new_h - top, left, size - new_w - left,
+                                cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    image = padded[:, :, ::-1].transpose(2, 0, 1)  # BGR HWC -> RGB CHW
+    return np.ascontiguousarray(image, dtype=np.float32)[None] / 255.0
+
+
+def _sample_frames(video_path: str, num_frames: int):
+    """Reads `num_frames` frames spread evenly over the video."""
+    cap = cv2.VideoCapture(video_path)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frames = []
+    for frame_idx in np.linspace(0, max(frame_count - 1, 0), num_frames).astype(int):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(frame_idx))
+        ret, frame = cap.read()
+        if ret:
+            frames.append(frame)
+    cap.release()
+    return frames
+
+
+def _quantize_onnx_int8(fp32_path: str, int8_path: str, calibration_video: str, num_frames: int):
+    """Static int8 post-training quantization of an exported ONNX model, calibrated on our own frames."""
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    input_name = onnx.load(fp32_path).graph.input[0].name
+    frames = _sample_frames(calibration_video, num_frames)
+    if not frames:
+        raise ValueError(f"could not read calibration frames from '{calibration_video}'")
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self.inputs = iter([{input_name: _letterbox(frame)} for frame in frames])
+
+        def get_next(self):
+            return next(self.inputs, None)
+
+    quantize_static(fp32_path, int8_path, FrameReader(), quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True)
+
+    # Keep the class names, stride and image size ultralytics stored in the model metadata
+    fp32_model, int8_model = onnx.load(fp32_path), onnx.load(int8_path)
+    del int8_model.metadata_props[:]
+    int8_model.metadata_props.extend(fp32_model.metadata_props)
+    onnx.save(int8_model, int8_path)
+
+
+def export_model(weights_path: str, backend: str, int8: bool = False, calibration_video: str = None,
+                 calibration_frames: int = CALIBRATION_FRAMES) -> str:
+    """
+    Exports the trained .pt weights for a CPU-optimized `backend` and returns the exported model path.
+
+    With `int8=True` the model is also quantized: OpenVINO calibrates on the training dataset
+    (`CALIBRATION_DATA`) and ONNX calibrates on `calibration_frames` frames of `calibration_video`.
+    """
+    from ultralytics import YOLO
+
+    output_path = backend_model_path(weights_path, backend, int8)
+    if backend == "torch":
+        return output_path
+
+    pt_model = YOLO(weights_path)
+    if backend == "openvino":
+        calibration = {"int8": True, "data": CALIBRATION_DATA} if int8 else {}
+        return pt_model.export(format="openvino", imgsz=IMAGE_SIZE, dynamic=True, **calibration)
+
+    fp32_path = backend_model_path(weights_path, "onnx")
+    if not os.path.exists(fp32_path) or os.path.getmtime(fp32_path) < os.path.getmtime(weights_path):
+        fp32_path = pt_model.export(format="onnx", imgsz=IMAGE_SIZE, dynamic=True, simplify=True)
+    if not int8:
+        return fp32_path
+    if calibration_video is None:
+        raise ValueError("ONNX int8 quantization needs a calibration_video to sample frames from")
+    _quantize_onnx_int8(fp32_path, output_path, calibration_video, calibration_frames)
+    return output_path
+
+
+def load_backend_model(weights_path: str, backend: str = "torch", int8: bool = False):
+    """
+    Loads the kill detector for `backend`, exporting the weights first if that has not been done yet
+    (or if the export is older than the weights).
+    """
+    from ultralytics import YOLO
+
+    path = backend_model_path(weights_path, backend, int8)
+    stale = not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(weights_path)
+    if backend != "torch" and stale:
+        if backend == "onnx" and int8:
+            raise FileNotFoundError(f"'{path}' is missing or outdated, run export_model(..., 'onnx', int8=True, "
+                                    f"calibration_video=...) first")
+        path = export_model(weights_path, backend, int8)
+    return YOLO(path, task="detect")
+
+
+def _box_iou(a, b) -> float:
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(x2 - x1, 0) * max(y2 - y1, 0)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def check_backend_parity(video_path: str, weights_path: str, backend: str, int8: bool = False,
+                         num_frames: int = 32, conf: float = 0.25, iou_threshold: float = 0.5) -> dict:
+    """
+    Runs the PyTorch model and the `backend` model on `num_frames` frames of a sample clip and compares
+    their detections: a backend box matches a reference box of the same class with IoU >= `iou_threshold`.
+    Returns the match counts, precision/recall against PyTorch and the mean confidence difference.
+    """
+    from ultralytics import YOLO
+
+    reference_model = YOLO(weights_path)
+    backend_model = load_backend_model(weights_path, backend, int8)
+    frames = _sample_frames(video_path, num_frames)
+
+    matched, reference_total, backend_total, conf_deltas = 0, 0, 0, []
+    for frame in frames:
+        reference = reference_model(frame, conf=conf, verbose=False)[0].boxes
+        candidate = backend_model(frame, conf=conf, verbose=False)[0].boxes
+        ref_boxes = list(zip(reference.cls.tolist(), reference.conf.tolist(), reference.xyxy.tolist()))
+        cand_boxes = list(zip(candidate.cls.tolist(), candidate.conf.tolist(), candidate.xyxy.tolist()))
+        reference_total += len(ref_boxes)
+        backend_total += len(cand_boxes)
+
+        # Greedy one-to-one matching, highest confidence backend boxes first
+        unmatched = list(ref_boxes)
+        for cls, box_conf, box in sorted(cand_boxes, key=lambda b: -b[1]):
+            best = max(((_box_iou(box, ref[2]), ref) for ref in unmatched if ref[0] == cls),
+                       default=(0.0, None), key=lambda pair: pair[0])
+            if best[1] is not None and best[0] >= iou_threshold:
+                unmatched.remove(best[1])
+                matched += 1
+                conf_deltas.append(abs(box_conf - best[1][1]))
+
+    report = {
+        "backend": backend,
+        "int8": int8,
+        "frames": len(frames),
+        "reference_boxes": reference_total,
+        "backend_boxes": backend_total,
+        "matched_boxes": matched,
+        "precision": matched / backend_total if backend_total else 1.0,
+        "recall": matched / reference_total if reference_total else 1.0,
+        "mean_conf_delta": float(np.mean(conf_deltas)) if conf_deltas else 0.0,
+    }
+    print(f"Parity {backend}{' int8' if int8 else ''} vs torch: {report}")
+    return report
+
+
+if __name__ == "__main__":
+    weights = "runs/detect/train12/weights/best.pt"
+    sample_video = "valorant.mp4"  # replace with a short clip of your own footage
+    export_model(weights, "onnx", int8=True, calibration_video=sample_video)
+    check_backend_parity(sample_video, weights, "onnx", int8=True)
@@ -0,0 +1,32 @@
+import os
+import threading
+
+# Trained kill detector weights used when no other path is given
+DEFAULT_WEIGHTS_PATH = "runs/detect/train12/weights/best.pt"
+
+_models = {}  # (weights path, backend, int8, slot) -> loaded model
+_lock = threading.Lock()
+
+
+def get_model(weights_path: str = DEFAULT_WEIGHTS_PATH, backend: str = "torch", int8: bool = False,
+              slot: int = 0):
+    """
+    Returns the model for `weights_path` on `backend`, loading it on first use and keeping it warm for
+    every later call in this process. Models are not safe to run from several threads at once, so
+    threads that infer concurrently ask for different `slot`s and each get their own instance.
+
+    torch/ultralytics are only imported here, so importing the detector does not pay for them.
+    """
+    key = (os.path.abspath(weights_path), backend, int8, slot)
+    with _lock:
+        if key not in _models:
+            from model_backends import load_backend_model
+            print(f"Loading kill detector '{weights_path}' ({backend}{', int8' if int8 else ''})")
+            _models[key] = load_backend_model(weights_path, backend, int8)
+        return _models[key]
+
+
+def clear_models():
+    """Drops every loaded model, e.g. after re-training or re-exporting the weights."""
+    with _lock:
+        _models.clear()
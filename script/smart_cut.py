@@ -0,0 +1,198 @@
+import json
+import os
+import subprocess
+import tempfile
+import numpy as np
+from video_index import load_index
+
+# Encoders matching the source codec, the head of a smart cut must use the same codec as the copied rest
+HEAD_ENCODERS = {"h264": "libx264", "hevc": "libx265"}
+# The head and the copied tail come from different encoders with different parameter sets (SPS/PPS), so they
+# are joined as Annex-B MPEG-TS, which carries those in-band in front of every keyframe
+ANNEXB_FILTERS = {"h264": "h264_mp4toannexb", "hevc": "hevc_mp4toannexb"}
+# Seconds decoded on each side of the join to check a smart cut
+JOIN_CHECK_SECONDS = 1.0
+# Quality of the re-encoded head (visually lossless) and audio bitrate of the clips
+HEAD_CRF = 18
+AUDIO_BITRATE = "192k"
+# A keyframe this close (in seconds) to the clip start counts as being on it, nothing to re-encode
+KEYFRAME_TOLERANCE = 0.001
+
+
+def _run_ffmpeg(cmd):
+    res = subprocess.run(cmd, capture_output=True, text=True)
+    if res.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({' '.join(cmd)}): {res.stderr.strip()}")
+    return res
+
+
+def _parse_rate(rate: str) -> float:
+    num, _, den = (rate or "0/0").partition("/")
+    return float(num) / float(den or 1) if float(den or 1) > 0 else 0.0
+
+
+def probe_source(video_path: str) -> dict:
+    """
+    Video codec, pixel format, FPS and duration (in seconds) of `video_path`, whether it has audio,
+    how much later than the video the audio starts (`audio_offset`) and how much later than the start
+    of the file the video starts (`video_offset`, in seconds), read with ffprobe.
+    """
+    cmd = ["ffprobe", "-v", "error", "-show_entries",
+           "stream=codec_type,codec_name,pix_fmt,avg_frame_rate,r_frame_rate,start_time:format=duration,start_time",
+           "-of", "json", video_path]
+    info = json.loads(_run_ffmpeg(cmd).stdout)
+    streams = info.get("streams", [])
+    video = next((stream for stream in streams if stream.get("codec_type") == "video"), None)
+    audio = next((stream for stream in streams if stream.get("codec_type") == "audio"), None)
+    if video is None:
+        raise ValueError(f"'{video_path}' has no video stream")
+    audio_offset = video_offset = 0.0
+    if audio is not None and "start_time" in audio and "start_time" in video:
+        audio_offset = float(audio["start_time"]) - float(video["start_time"])
+    if "start_time" in video and "start_time" in info.get("format", {}):
+        video_offset = float(video["start_time"]) - float(info["format"]["start_time"])
+    return {"codec": video.get("codec_name"), "pix_fmt": video.get("pix_fmt"),
+            "fps": _parse_rate(video.get("avg_frame_rate")) or _parse_rate(video.get("r_frame_rate")),
+            "duration": float(info.get("format", {}).get("duration", 0.0)),
+            "has_audio": audio is not None, "audio_offset": audio_offset, "video_offset": video_offset}
+
+
+def keyframe_times(video_path: str) -> np.ndarray:
+    """
+    Sorted keyframe timestamps (in seconds from the start of the video stream) of the video, from its
+    cached packet index (see video_index.py).
+    """
+    return load_index(video_path).keyframe_times()
+
+
+def _encode(video_path: str, start: float, end: float, output_path: str, info: dict, audio: bool,
+            threads: int = None):
+    """Frame-accurate re-encode of [start, end) with the source codec and pixel format."""
+    cmd = ["ffmpeg", "-hide_banner", "-y", "-ss", f"{start:.6f}", "-i", video_path, "-t", f"{end - start:.6f}",
+           "-c:v", HEAD_ENCODERS.get(info["codec"], "libx264"), "-crf", str(HEAD_CRF), "-preset", "veryfast"]
+    if threads:
+        cmd += ["-threads", str(threads)]
+    if info["pix_fmt"]:
+        cmd += ["-pix_fmt", info["pix_fmt"]]
+    cmd += ["-c:a", "aac", "-b:a", AUDIO_BITRATE] if audio else ["-an"]
+    _run_ffmpeg(cmd + [output_path])
+
+
+def _decodes_cleanly(video_path: str, start: float, duration: float) -> bool:
+    """Whether [start, start + duration) of `video_path` decodes without a single decoder error."""
+    res = subprocess.run(["ffmpeg", "-hide_banner", "-v", "error", "-xerror", "-ss", f"{start:.6f}", "-i", video_path,
+                          "-t", f"{duration:.6f}", "-map", "0:v:0", "-f", "null", "-"], capture_output=True, text=True)
+    return res.returncode == 0 and not res.stderr.strip()
+
+
+def smart_cut(video_path: str, start: float, end: float, output_path: str, keyframes: np.ndarray = None,
+              info: dict = None, threads: int = None):
+    """
+    Cuts [start, end) out of `video_path` into `output_path` while re-encoding as little as possible:
+    only the partial GOP between `start` and the first keyframe after it is re-encoded (with the
+    source codec), everything from that keyframe on is stream-copied, and the two parts are joined
+    without re-encoding by the concat demuxer. The audio of the whole range is re-encoded on its own
+    so it stays sample accurate. The frames around the join are decoded as a check, and a cut that
+    does not decode cleanly is redone as a full re-encode.
+
+    `keyframes` (see `keyframe_times`) and `info` (see `probe_source`) can be passed in when cutting
+    many clips from the same video. Sources in a codec we cannot re-encode to are fully re-encoded.
+    `threads` limits the threads of the encoders (ffmpeg's default is one per core).
+    """
+    if end <= start:
+        raise ValueError(f"clip end ({end}) must be after its start ({start})")
+    info = info or probe_source(video_path)
+    keyframes = keyframe_times(video_path) if keyframes is None else keyframes
+    # ffmpeg seeks from the start of the file (its earliest stream), not from the start of the video stream.
+    # When the audio starts first, an unshifted keyframe time lands in the GOP before the keyframe and the
+    # copied tail repeats the re-encoded head
+    keyframes = np.asarray(keyframes) + info["video_offset"]
+
+    # First keyframe at or after the start (within tolerance)
+    pos = np.searchsorted(keyframes, start - KEYFRAME_TOLERANCE)
+    keyframe = keyframes[pos] if pos < len(keyframes) else None
+    if keyframe is None or keyframe >= end or info["codec"] not in HEAD_ENCODERS:
+        # No keyframe inside the clip (or an unknown codec), the whole clip is the "head"
+        _encode(video_path, start, end, output_path, info, audio=True, threads=threads)
+        return output_path
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_path))) as work_dir:
+        parts = []
+
+        # 1. Re-encode the partial GOP before the first keyframe
+        if keyframe - start > KEYFRAME_TOLERANCE:
+            head_path = os.path.join(work_dir, "head.ts")
+            _encode(video_path, start, keyframe, head_path, info, audio=False, threads=threads)
+            parts.append(head_path)
+
+        # 2. Stream-copy from the keyframe to the end, seeking to a keyframe is exact with -c copy
+        tail_path = os.path.join(work_dir, "tail.ts")
+        _run_ffmpeg(["ffmpeg", "-hide_banner", "-y", "-ss", f"{keyframe:.6f}", "-i", video_path,
+                     "-t", f"{end - keyframe:.6f}", "-map", "0:v:0", "-c:v", "copy", "-an",
+                     "-bsf:v", ANNEXB_FILTERS[info["codec"]], "-avoid_negative_ts", "make_zero", tail_path])
+        parts.append(tail_path)
+
+        # 3. Join the video losslessly and add the re-encoded audio of the whole range
+        list_path = os.path.join(work_dir, "parts.txt")
+        with open(list_path, "w") as f:
+            for part in parts:
+                f.write(f"file '{part}'\n")
+        _run_ffmpeg(["ffmpeg", "-hide_banner", "-y", "-f", "concat", "-safe", "0", "-i", list_path,
+                     "-ss", f"{start:.6f}", "-t", f"{end - start:.6f}", "-i", video_path,
+                     "-map", "0:v:0", "-map", "1:a:0?", "-c:v", "copy", "-c:a", "aac", "-b:a", AUDIO_BITRATE,
+                     *(["-threads", str(threads)] if threads else []),
+                     "-shortest", "-movflags", "+faststart", output_path])
+
+    # 4. The tail must decode with its own parameter sets, check the frames on both sides of the join
+    join = keyframe - start
+    if join > KEYFRAME_TOLERANCE and not _decodes_cleanly(output_path, max(join - JOIN_CHECK_SECONDS, 0.0),
+                                                          2 * JOIN_CHECK_SECONDS):
+        print(f"Smart cut of {start:.2f}-{end:.2f}s of '{video_path}' does not decode cleanly, re-encoding it")
+        _encode(video_path, start, end, output_path, info, audio=True, threads=threads)
+    return output_path
+
+
+def cut_clips_single_pass(video_path: str, windows, output_paths, info: dict = None, threads: int = None):
+    """
+    Writes every (start, end) window of `video_path` to the matching entry of `output_paths` with a
+    single ffmpeg run: the source is read and decoded once, sequentially from the first window to the
+    last, and split into one trim/atrim branch (and one encoder) per clip. Overlapping or adjacent
+    windows therefore never decode the same frames twice.
+    """
+    if len(windows) != len(output_paths):
+        raise ValueError(f"got {len(windows)} windows for {len(output_paths)} output paths")
+    if not windows:
+        return []
+    for start, end in windows:
+        if end <= start:
+            raise ValueError(f"clip end ({end}) must be after its start ({start})")
+    info = info or probe_source(video_path)
+
+    # Only decode the part of the source the clips cover
+    first_start = min(start for start, _ in windows)
+    last_end = max(end for _, end in windows)
+
+    count = len(windows)
+    graph = [f"[0:v]split={count}" + "".join(f"[v{i}]" for i in range(count))]
+    if info["has_audio"]:
+        graph.append(f"[0:a]asplit={count}" + "".join(f"[a{i}]" for i in range(count)))
+    for i, (start, end) in enumerate(windows):
+        start, end = start - first_start, end - first_start
+        graph.append(f"[v{i}]trim=start={start:.6f}:end={end:.6f},setpts=PTS-STARTPTS[vout{i}]")
+        if info["has_audio"]:
+            graph.append(f"[a{i}]atrim=start={start:.6f}:end={end:.6f},asetpts=PTS-STARTPTS[aout{i}]")
+
+    cmd = ["ffmpeg", "-hide_banner", "-y", "-ss", f"{first_start:.6f}", "-t", f"{last_end - first_start:.6f}",
+           "-i", video_path, "-filter_complex", ";".join(graph)]
+    for i, output_path in enumerate(output_paths):
+        cmd += ["-map", f"[vout{i}]", "-c:v", HEAD_ENCODERS.get(info["codec"], "libx264"),
+                "-crf", str(HEAD_CRF), "-preset", "veryfast"]
+        if info["pix_fmt"]:
+            cmd += ["-pix_fmt", info["pix_fmt"]]
+        if threads:
+            cmd += ["-threads", str(threads)]
+        if info["has_audio"]:
+            cmd += ["-map", f"[aout{i}]", "-c:a", "aac", "-b:a", AUDIO_BITRATE]
+        cmd += ["-movflags", "+faststart", output_path]
+    _run_ffmpeg(cmd)
+    return list(output_paths)
@@ -1,7 +1,12 @@
 import os
-import subprocess
+import sys
 import pathlib
 from moviepy.editor import VideoFileClip, AudioFileClip, concatenate_videoclips, CompositeAudioClip, concatenate_audioclips
+from clip_manifest import load_manifest
+
+# vid_transition.py lives in the repository root, one level above this folder
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from vid_transition import make_transition_video
 
 def apply_audio_mixing_to_clip(video_clip, music_audio, start_time_in_music):
     """
@@ -67,22 +72,46 @@ def apply_audio_mixing_to_clip(video_clip, music_audio, start_time_in_music):
 
 def generate_final_montage(clips_folder: str, music_path: str, output_path: str):
     """
-    Create a montage from existing clip files using vid_transition.py directly.
+    Create a montage from existing clip files, with the transitions made in-process by vid_transition.py.
+    If the folder holds a clip manifest (virtual clips, see clip_manifest.py) instead, the clips and
+    the transition frames are read straight from the source video ranges it lists.
     
     Args:
         clips_folder: Folder containing the kill clips
         music_path: Path to the music file
         output_path: Path for the output video
     """
-    # Get list of all clip files sorted by name
-    clip_files = sorted([os.path.join(clips_folder, f) for f in os.listdir(clips_folder) 
-                         if f.endswith(".mp4")])
+    # Get list of all clip files sorted by name, or the virtual clips of the manifest in order
+    manifest_clips = load_manifest(clips_folder)
+    if manifest_clips is None:
+        clip_files = sorted([os.path.join(clips_folder, f) for f in os.listdir(clips_folder)
+                             if f.endswith(".mp4")])
+        num_clips = len(clip_files)
+    else:
+        num_clips = len(manifest_clips)
     
-    if len(clip_files) < 2:
-        print(f"Error: Need at least 2 video clips to create transitions. Found {len(clip_files)} clips.")
+    if num_clips < 2:
+        print(f"Error: Need at least 2 video clips to create transitions. Found {num_clips} clips.")
         return
     
-    print(f"Found {len(clip_files)} clips to process")
+    print(f"Found {num_clips} clips to process")
+
+    source_videos = {}  # source path -> reader shared by every virtual clip of that source
+
+    def open_clip(idx):
+        if manifest_clips is None:
+            return VideoFileClip(clip_files[idx])
+        clip = manifest_clips[idx]
+        if clip["source"] not in source_videos:
+            source_videos[clip["source"]] = VideoFileClip(clip["source"])
+        return source_videos[clip["source"]].subclip(clip["start"], clip["end"])
+
+    def transition_inputs(idx):
+        """The two input videos of the transition after clip `idx`, and their (start1, end1, start2, end2) ranges."""
+        if manifest_clips is None:
+            return [clip_files[idx], clip_files[idx + 1]], None
+        clip1, clip2 = manifest_clips[idx], manifest_clips[idx + 1]
+        return [clip1["source"], clip2["source"]], [clip1["start"], clip1["end"], clip2["start"], clip2["end"]]
     
     # Temporary folder for transition outputs
     work_dir = pathlib.Path("temp_transitions")
@@ -97,7 +126,7 @@ def generate_final_montage(clips_folder: str, music_path: str, output_path: str)
     current_music_time = 0.0
     
     # Load first clip and get FPS for frame calculations
-    first_clip = VideoFileClip(clip_files[0])
+    first_clip = open_clip(0)
     fps = first_clip.fps if first_clip.fps else 30  # Default to 30 FPS if not available
     frames_to_drop = 8
     time_to_drop = frames_to_drop / fps  # Convert frames to time in seconds
@@ -108,11 +137,8 @@ def generate_final_montage(clips_folder: str, music_path: str, output_path: str)
     processed_clips.append(first_clip_with_audio)
     current_music_time += first_clip_trimmed.duration
     
-    # Process each pair of consecutive clips with vid_transition.py
-    for i in range(len(clip_files) - 1):
-        clip1 = clip_files[i]
-        clip2 = clip_files[i + 1]
-        
+    # Process each pair of consecutive clips with vid_transition.py, in this process
+    for i in range(num_clips - 1):
         transition_output = work_dir / f"transition_{i}_{i+1}_merged.mp4"
         
         print(f"Creating transition between clip {i+1} and clip {i+2}...")
@@ -121,19 +147,12 @@ def generate_final_montage(clips_folder: str, music_path: str, output_path: str)
         transition_types = ['rotation', 'zoom_in', 'zoom_out', 'translation', 'translation_inv']
         transition_type = transition_types[i % len(transition_types)]
         
-        # Call vid_transition.py directly
-        cmd = [
-            "python", "vid_transition.py",
-            "-i", clip1, clip2,
-            "--animation", transition_type,
-            "--num_frames", "8",
-            "--max_brightness", "3",
-            "--merge", "true",
-            "--output", str(work_dir / f"transition_{i}_{i+1}")
-        ]
+        # All clips share the FPS of the first one, which spares vid_transition.py probing every input
+        inputs, ranges = transition_inputs(i)
         
         try:
-            subprocess.run(cmd, check=True)
+            make_transition_video(inputs, work_dir / f"transition_{i}_{i+1}", animation=transition_type,
+                                  num_frames=8, ranges=ranges, max_brightness=3, fps=fps, merge=True)
             
             if transition_output.exists():
                 # Add the transition with audio mixing
@@ -143,11 +162,11 @@ def generate_final_montage(clips_folder: str, music_path: str, output_path: str)
                 current_music_time += transition_clip.duration
                 
                 # Load the next clip
-                next_clip = VideoFileClip(clip_files[i + 1])
+                next_clip = open_clip(i + 1)
                 
                 # For ALL clips after the first one: remove FIRST 8 frames (already used in transition)
                 # For clips that aren't the last one: also remove LAST 8 frames (for next transition)
-                if i < len(clip_files) - 2:
+                if i < num_clips - 2:
                     # Intermediate clip: remove first 8 frames AND last 8 frames
                     next_clip_trimmed = next_clip.subclip(time_to_drop, next_clip.duration - time_to_drop)
                 else:
@@ -163,8 +182,8 @@ def generate_final_montage(clips_folder: str, music_path: str, output_path: str)
             else:
                 print(f"Warning: Transition file {transition_output} was not created")
                 # Fallback: add next clip with proper trimming
-                next_clip = VideoFileClip(clip_files[i + 1])
-                if i < len(clip_files) - 2:
+                next_clip = open_clip(i + 1)
+                if i < num_clips - 2:
                     next_clip_trimmed = next_clip.subclip(time_to_drop, next_clip.duration - time_to_drop)
                 else:
                     next_clip_trimmed = next_clip.subclip(time_to_drop)
@@ -174,11 +193,11 @@ def generate_final_montage(clips_folder: str, music_path: str, output_path: str)
                 current_music_time += next_clip_trimmed.duration
    
 
-        except subprocess.CalledProcessError as e:
+        except Exception as e:  # A failed transition only costs the transition, like the subprocess used to
             print(f"Error creating transition: {e}")
             # Fallback: add next clip with proper trimming
-            next_clip = VideoFileClip(clip_files[i + 1])
-            if i < len(clip_files) - 2:
+            next_clip = open_clip(i + 1)
+            if i < num_clips - 2:
                 next_clip_trimmed = next_clip.subclip(time_to_drop, next_clip.duration - time_to_drop)
             else:
                 next_clip_trimmed = next_clip.subclip(time_to_drop)
@@ -202,6 +221,8 @@ def generate_final_montage(clips_folder: str, music_path: str, output_path: str)
     # Clean up
     for clip in processed_clips:
         clip.close()
+    for video in source_videos.values():
+        video.close()
     music_audio.close()
     final_video.close()
     
@@ -0,0 +1,126 @@
+import os
+import subprocess
+import numpy as np
+
+# One record per video packet, in presentation order
+PACKET_DTYPE = np.dtype([
+    ("pts", "<i8"),        # presentation timestamp, in stream time base units
+    ("keyframe", "?"),     # whether decoding can start at this packet
+])
+# The index is cached next to the video as `<video file>` + INDEX_SUFFIX
+INDEX_SUFFIX = ".index.npz"
+INDEX_VERSION = 2
+
+
+def _parse_rate(rate: str):
+    num, _, den = (rate or "0/0").partition("/")
+    return (int(num or 0), int(den or 1)) if "/" in (rate or "") else (0, 1)
+
+
+def _probe(cmd):
+    res = subprocess.run(cmd, capture_output=True, text=True)
+    if res.returncode != 0:
+        raise RuntimeError(f"ffprobe failed ({' '.join(cmd)}): {res.stderr.strip()}")
+    return res.stdout
+
+
+class VideoIndex:
+    """
+    Keyframe and packet index of the first video stream of a file: every packet's timestamp and
+    keyframe flag, plus the stream time base and frame rate. Built once with a single
+    ffprobe pass over the packets (nothing is decoded) and cached next to the video, see `load_index`.
+    """
+    def __init__(self, packets: np.ndarray, time_base, frame_rate, start_pts: int):
+        self.packets = packets
+        self.time_base = tuple(time_base)  # (numerator, denominator), seconds per pts unit
+        self.frame_rate = tuple(frame_rate)  # (numerator, denominator)
+        self.start_pts = start_pts
+
+    @property
+    def fps(self) -> float:
+        return self.frame_rate[0] / self.frame_rate[1] if self.frame_rate[1] else 0.0
+
+    def to_seconds(self, pts) -> np.ndarray:
+        """Converts stream timestamps to seconds from the start of the stream."""
+        return (np.asarray(pts, dtype=np.float64) - self.start_pts) * self.time_base[0] / self.time_base[1]
+
+    def keyframe_times(self) -> np.ndarray:
+        """Sorted keyframe timestamps, in seconds from the start of the stream."""
+        return self.to_seconds(self.packets["pts"][self.packets["keyframe"]])
+
+    def keyframe_frames(self) -> np.ndarray:
+        """Sorted frame indices of the keyframes (exact for constant frame rate video)."""
+        return np.round(self.keyframe_times() * self.fps).astype(np.int64)
+
+    def save(self, path: str, source_stat):
+        """Writes the index, tagged with the size and mtime of the video it was built from."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, version=INDEX_VERSION, packets=self.packets, time_base=np.array(self.time_base),
+                     frame_rate=np.array(self.frame_rate), start_pts=self.start_pts,
+                     source=np.array([source_stat.st_size, source_stat.st_mtime_ns]))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, source_stat=None):
+        """Reads a saved index, or returns None if it is outdated (the video changed since it was built)."""
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != INDEX_VERSION:
+                return None
+            if source_stat is not None and list(data["source"]) != [source_stat.st_size, source_stat.st_mtime_ns]:
+                return None
+            return cls(data["packets"], data["time_base"].tolist(), data["frame_rate"].tolist(),
+                       int(data["start_pts"]))
+
+
+def build_index(video_path: str) -> VideoIndex:
+    """Indexes the packets of the first video stream of `video_path` with ffprobe."""
+    stream_info = _probe(["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries",
+                          "stream=time_base,avg_frame_rate,r_frame_rate,start_pts", "-of", "default=nw=1",
+                          video_path])
+    stream = dict(line.split("=", 1) for line in stream_info.splitlines() if "=" in line)
+    if "time_base" not in stream:
+        raise ValueError(f"'{video_path}' has no video stream")
+    frame_rate = _parse_rate(stream.get("avg_frame_rate"))
+    if not frame_rate[0]:
+        frame_rate = _parse_rate(stream.get("r_frame_rate"))
+
+    # One "pts,flags" line per packet, in decoding order
+    rows = []
+    for line in _probe(["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries",
+                        "packet=pts,flags", "-of", "csv=p=0", video_path]).splitlines():
+        pts, flags = (line.split(",") + ["", ""])[:2]
+        if pts in ("", "N/A"):
+            continue
+        rows.append((int(pts), "K" in flags))
+    packets = np.sort(np.array(rows, dtype=PACKET_DTYPE), order="pts")
+
+    start_pts = stream.get("start_pts", "N/A")
+    start_pts = int(start_pts) if start_pts not in ("", "N/A") else (int(packets["pts"][0]) if len(packets) else 0)
+    return VideoIndex(packets, _parse_rate(stream["time_base"]), frame_rate, start_pts)
+
+
+def index_path(video_path: str) -> str:
+    return video_path + INDEX_SUFFIX
+
+
+def load_index(video_path: str, cached_only: bool = False) -> VideoIndex:
+    """
+    Returns the index of `video_path`, read from `<video file>.index.npz` when it is up to date and
+    built (and saved there) otherwise. With `cached_only=True`, returns None instead of building it.
+    """
+    path = index_path(video_path)
+    source_stat = os.stat(video_path)
+    if os.path.exists(path):
+        index = VideoIndex.load(path, source_stat)
+        if index is not None:
+            return index
+    if cached_only:
+        return None
+
+    index = build_index(video_path)
+    try:
+        index.save(path, source_stat)
+    except OSError as e:
+        print(f"Could not cache the index of '{video_path}': {e}")  # e.g. a read-only folder
+    return index
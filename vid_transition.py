@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 __package__ = "vid_transition"
 import math
+import functools
 import pathlib
 import enum
 import logging
@@ -9,10 +10,26 @@ import shutil
 import subprocess
 import argparse
 import tempfile
-from PIL import Image, ImageOps, ImageEnhance, ImageFilter
+import sys
+import numpy as np
+from PIL import Image, ImageEnhance, ImageFilter
+
+try:
+    # optional, remaps the distorted frames faster than the numpy fallback
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    # keyframe/packet index of the ClipSyncAI scripts, lets already indexed videos skip the FPS probe
+    sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent / "script"))
+    from video_index import load_index
+except ImportError:
+    load_index = None
 
 # default variables used in arg-parser
 INPUT_VIDEOS = []
+INPUT_RANGES = []
 OUTPUT = ""
 NUM_FRAMES = 10
 ANIMATION = "rotation"
@@ -25,11 +42,15 @@ DEBUG = False
 ART = True
 REMOVE_ORIGINAL = False
 MERGE_PHASES = False
+FPS = 0
 
 
 # variable that cannot be changed by arg-parser
 _OUTPUT_VIDEO_TYPE = ".mp4"
 _OUTPUT_VIDEO_CODEC = "h264"
+# number of per-pixel distortion maps kept in memory (16 MB each for 1080p frames), a transition uses one
+# per distinct distortion value and every transition of a montage reuses the same values
+_DISTORTION_MAPS_CACHE_SIZE = 16
 _LIMITS = {"rotation": (5, 90), "brightness": (0.0, 3), "blur": (0.005, 1.0),
            "distortion": (0.3, 1.0), "zoom": (1.2, 2.0)}
 _ANIMATION_HELP = f"""  
@@ -481,6 +502,16 @@ class AnimationImages:
             source_y = self.half_height + theta * new_y * self.zoom
             return source_x, source_y
 
+        def transform_arrays(self, x, y):
+            """vectorized transform, for numpy arrays of coordinates"""
+            new_x = x - self.half_width
+            new_y = y - self.half_height
+            r = np.sqrt(new_x ** 2 + new_y ** 2) / self.correction_radius
+            theta = np.divide(np.arctan(r), r, out=np.ones_like(r), where=r != 0)
+            source_x = self.half_width + theta * new_x * self.zoom
+            source_y = self.half_height + theta * new_y * self.zoom
+            return source_x, source_y
+
         def transform_rectangle(self, x0, y0, x1, y1):
             return (*self.transform(x0, y0),
                     *self.transform(x0, y1),
@@ -488,7 +519,9 @@ class AnimationImages:
                     *self.transform(x1, y0))
 
         def determine_parameters(self, img):
-            width, height = img.size
+            self.set_size(*img.size)
+
+        def set_size(self, width, height):
             self.half_width = width / 2
             self.half_height = height / 2
             self.correction_radius = (min(self.half_width, self.half_height) * 10) * (1 - self.strength) ** 2 + 1
@@ -566,24 +599,11 @@ class AnimationImages:
                         msg += f" - action [{action.action_type.name} => {value:g}]"
                     msg += f" - folder [{img_save_folder.name}]"
                     log_debug(msg)
-                    if action.action_type == FramesActions.Type.mirror:
-                        img = AnimationImages.mirror_image_effect(img, value)
-                    elif action.action_type == FramesActions.Type.zoom:
-                        img = AnimationImages.zoom_effect(img, value)
-                    elif action.action_type == FramesActions.Type.crop:
-                        img = AnimationImages.crop_effect(img, value, original_size)
-                    elif action.action_type == FramesActions.Type.rotation:
-                        img = AnimationImages.rotation_effect(img, value)
-                    elif action.action_type == FramesActions.Type.blur:
-                        img = AnimationImages.blur_effect(img, value)
-                    elif action.action_type == FramesActions.Type.distortion:
-                        img = AnimationImages.distortion_effect(img, value)
-                        if value > peak_distortion_value:
-                            peak_distortion_msg = AnimationImages.PincushionDeformation(value, 1.0).get_debug_info(img)
-                            peak_distortion_value = value
-                            peak_distortion_img = img_path
-                    elif action.action_type == FramesActions.Type.brightness:
-                        img = AnimationImages.brightness_effect(img, value)
+                    img = AnimationImages.apply_action(img, action.action_type, value, original_size)
+                    if action.action_type == FramesActions.Type.distortion and value > peak_distortion_value:
+                        peak_distortion_msg = AnimationImages.PincushionDeformation(value, 1.0).get_debug_info(img)
+                        peak_distortion_value = value
+                        peak_distortion_img = img_path
                     if debug or action_idx == len(actions) - 1:
                         img.save(str(img_save_folder / img_path.name))
 
@@ -594,6 +614,39 @@ class AnimationImages:
                 log_debug(line)
         return res_folder
 
+    @staticmethod
+    def transition_frames(in_images1, in_images2, in_actions1, in_actions2):
+        """
+        in-memory version of make_transition: takes the two phases as lists of PIL images and returns
+        the two lists of transition frames, nothing is written to disk
+        """
+        res_images = [[], []]
+        for phase_idx, (images, actions) in enumerate([(in_images1, in_actions1), (in_images2, in_actions2)]):
+            for img_idx, img in enumerate(images):
+                original_size = img.size
+                for action in actions:
+                    img = AnimationImages.apply_action(img, action.action_type, action.values[img_idx], original_size)
+                res_images[phase_idx].append(img)
+        return res_images
+
+    @staticmethod
+    def apply_action(in_img, action_type, value, original_size):
+        if action_type == FramesActions.Type.mirror:
+            return AnimationImages.mirror_image_effect(in_img, value)
+        elif action_type == FramesActions.Type.zoom:
+            return AnimationImages.zoom_effect(in_img, value)
+        elif action_type == FramesActions.Type.crop:
+            return AnimationImages.crop_effect(in_img, value, original_size)
+        elif action_type == FramesActions.Type.rotation:
+            return AnimationImages.rotation_effect(in_img, value)
+        elif action_type == FramesActions.Type.blur:
+            return AnimationImages.blur_effect(in_img, value)
+        elif action_type == FramesActions.Type.distortion:
+            return AnimationImages.distortion_effect(in_img, value)
+        elif action_type == FramesActions.Type.brightness:
+            return AnimationImages.brightness_effect(in_img, value)
+        return in_img
+
     @staticmethod
     def mirror_image_effect(in_img, mirror_direction):
         images = [in_img, in_img.transpose(0), in_img.transpose(1),
@@ -648,9 +701,45 @@ class AnimationImages:
         # print(blue_strength)
         return in_img.filter(ImageFilter.GaussianBlur(blue_strength))
 
+    @staticmethod
+    @functools.lru_cache(maxsize=_DISTORTION_MAPS_CACHE_SIZE)
+    def distortion_maps(width, height, strength, zoom=1.0):
+        """
+        source pixel coordinates (x map, y map) of every pixel of a distorted width x height image, computed
+        for all pixels at once with the same formula as PincushionDeformation.transform
+        """
+        deformation = AnimationImages.PincushionDeformation(strength, zoom)
+        deformation.set_size(width, height)
+        # the transform works on pixel edges, the maps on pixel centers
+        x, y = np.meshgrid(np.arange(width, dtype=np.float64) + 0.5, np.arange(height, dtype=np.float64) + 0.5)
+        source_x, source_y = deformation.transform_arrays(x, y)
+        return (source_x - 0.5).astype(np.float32), (source_y - 0.5).astype(np.float32)
+
+    @staticmethod
+    def remap(in_pixels, map_x, map_y):
+        """bilinear sampling of in_pixels at (map_x, map_y), black outside of it (numpy version of cv2.remap)"""
+        if cv2 is not None:
+            return cv2.remap(in_pixels, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        h, w = in_pixels.shape[:2]
+        # a black border of one pixel, samples outside of the image read only from it
+        padded = np.pad(in_pixels, ((1, 1), (1, 1)) + ((0, 0),) * (in_pixels.ndim - 2)).astype(np.float32)
+        x0, y0 = np.floor(map_x), np.floor(map_y)
+        fx, fy = map_x - x0, map_y - y0
+        if in_pixels.ndim == 3:
+            fx, fy = fx[..., None], fy[..., None]
+        x0 = np.clip(x0.astype(np.int64) + 1, 0, w + 1)
+        y0 = np.clip(y0.astype(np.int64) + 1, 0, h + 1)
+        x1, y1 = np.minimum(x0 + 1, w + 1), np.minimum(y0 + 1, h + 1)
+        top = padded[y0, x0] * (1 - fx) + padded[y0, x1] * fx
+        bottom = padded[y1, x0] * (1 - fx) + padded[y1, x1] * fx
+        return np.clip(np.rint(top * (1 - fy) + bottom * fy), 0, 255).astype(np.uint8)
+
     @staticmethod
     def distortion_effect(in_img, distortion_strength):
-        return ImageOps.deform(in_img, AnimationImages.PincushionDeformation(distortion_strength, 1.0))
+        if in_img.mode not in ("RGB", "RGBA", "L"):
+            in_img = in_img.convert("RGB")
+        map_x, map_y = AnimationImages.distortion_maps(in_img.width, in_img.height, distortion_strength)
+        return Image.fromarray(AnimationImages.remap(np.asarray(in_img), map_x, map_y), in_img.mode)
 
     @staticmethod
     def brightness_effect(in_img, brightness_value):
@@ -665,6 +754,7 @@ class DataHandler:
         self.output = None
         self.input_vid1 = None
         self.input_vid2 = None
+        self.input_ranges = None
         self.phase1_vid = None
         self.phase2_vid = None
         self.merged_vid = None
@@ -703,7 +793,10 @@ class DataHandler:
         else:
             log_info(f"output transition phase1 video: {self.phase1_vid}")
             log_info(f"output transition phase2 video: {self.phase2_vid}")
-        self._get_fps_from_video()
+        if in_args.fps > 0:
+            self.fps = in_args.fps
+        else:
+            self._get_fps_from_video()
         log_info(f"frames per second (FPS): {self.fps}")
 
         self.vid1_raw_images_folder = self.tmp_path / "1_phase1_raw"
@@ -754,6 +847,18 @@ class DataHandler:
         if not self.input_vid2.is_file():
             log_error(f"could not find second video under: {self.input_vid2}")
             return False
+        if in_args.ranges:
+            if len(in_args.ranges) != 4:
+                log_error(f"ranges needs 4 values (start1 end1 start2 end2), [{len(in_args.ranges)}] provided")
+                return False
+            start1, end1, start2, end2 = in_args.ranges
+            if not (0 <= start1 < end1 and 0 <= start2 < end2):
+                log_error(f"every range should satisfy 0 <= start < end (provided: {in_args.ranges})")
+                return False
+            if in_args.remove:
+                log_error("--remove cannot be used with --ranges, the inputs are the full source videos")
+                return False
+            self.input_ranges = [(start1, end1), (start2, end2)]
         if in_args.num_frames < 2 or in_args.num_frames > 100:
             log_error(f"number of frames per phase should be in the range [2, 100] (provided: [{in_args.num_frames}])")
             return False
@@ -771,8 +876,15 @@ class DataHandler:
 
     def _extract_phase1_images(self, in_num_frames):
         duration_ms = int(math.ceil(1000 * (in_num_frames + 2) / self.fps))
-        cmd = ["ffmpeg", "-hide_banner", "-sseof", f"-{duration_ms}ms", "-i", str(self.input_vid1),
-               str(self.vid1_raw_images_folder / "%04d.png")]
+        if self.input_ranges:
+            # the "video" ends at the end of its range, read the last frames of the range from the source
+            _, end = self.input_ranges[0]
+            start = max(end - duration_ms / 1000, 0)
+            cmd = ["ffmpeg", "-hide_banner", "-ss", f"{start:.3f}", "-t", f"{end - start:.3f}", "-i",
+                   str(self.input_vid1), str(self.vid1_raw_images_folder / "%04d.png")]
+        else:
+            cmd = ["ffmpeg", "-hide_banner", "-sseof", f"-{duration_ms}ms", "-i", str(self.input_vid1),
+                   str(self.vid1_raw_images_folder / "%04d.png")]
         self._exec_command(cmd, "command used for extracting images from video num 1:")
         for img_f in self.vid1_raw_images_folder.glob("*.png"):
             self.phase1_images.append(img_f)
@@ -787,8 +899,14 @@ class DataHandler:
 
     def _extract_phase2_images(self, in_num_frames):
         duration_ms = int(math.ceil(1000 * (in_num_frames + 2) / self.fps))
-        cmd = ["ffmpeg", "-hide_banner", "-to", f"{duration_ms}ms", "-i", str(self.input_vid2),
-               str(self.vid2_raw_images_folder / "%04d.png")]
+        if self.input_ranges:
+            # the "video" starts at the start of its range
+            start, end = self.input_ranges[1]
+            cmd = ["ffmpeg", "-hide_banner", "-ss", f"{start:.3f}", "-t", f"{min(duration_ms / 1000, end - start):.3f}",
+                   "-i", str(self.input_vid2), str(self.vid2_raw_images_folder / "%04d.png")]
+        else:
+            cmd = ["ffmpeg", "-hide_banner", "-to", f"{duration_ms}ms", "-i", str(self.input_vid2),
+                   str(self.vid2_raw_images_folder / "%04d.png")]
         self._exec_command(cmd, "command used for extracting images from video num 2:")
         for img_f in self.vid2_raw_images_folder.glob("*.png"):
             self.phase2_images.append(img_f)
@@ -801,6 +919,17 @@ class DataHandler:
             self.phase2_images = self.phase2_images[:in_num_frames]
         return True
 
+    @staticmethod
+    def _cached_index(in_video):
+        """the packet index of a video if it was already built (see script/video_index.py), never builds it"""
+        if load_index is None:
+            return None
+        try:
+            return load_index(str(in_video), cached_only=True)
+        except (OSError, ValueError) as e:
+            log_debug(f"could not read the packet index of [{in_video}]: {e}")
+            return None
+
     @staticmethod
     def _exec_command(in_cmd, in_presentation):
         log_debug("")
@@ -822,6 +951,11 @@ class DataHandler:
         return res.stdout, res.stderr
 
     def _get_fps_from_video(self):
+        index = self._cached_index(self.input_vid1)
+        if index is not None and index.fps > 0:
+            self.fps = int(round(index.fps))
+            log_debug(f"FPS read from the packet index of the video [{self.fps}]")
+            return
         cmd = ["ffmpeg", "-hide_banner", "-i", str(self.input_vid1)]
         stdout, stderr = self._exec_command(cmd, "command used for extracting FPS")
         res = (stdout.lower() + " " + stderr.lower()).split(" ")
@@ -893,6 +1027,11 @@ class DataHandler:
     @staticmethod
     def _setup_logging(debug, log_file_path):
         init_logger = logging.getLogger(__package__)
+        # every transition made in the same process (see create_transition) replaces the handlers of the
+        # previous one, instead of adding one more handler that prints every message again
+        for old_handler in list(init_logger.handlers):
+            init_logger.removeHandler(old_handler)
+            old_handler.close()
         if debug:
             init_logger.setLevel(logging.DEBUG)
         else:
@@ -909,6 +1048,87 @@ class DataHandler:
             init_logger.addHandler(handler)
 
 
+def create_transition(in_args):
+    """
+    makes a transition from parsed command line arguments (see the argument parser below), returns
+    the merged transition video (or the two phase videos when not merging), or None on failure
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = pathlib.Path(tmp_dir)
+        dh = DataHandler()
+        if not dh.verify_arguments(in_args, tmp_path):
+            return None
+
+        actions_determinator = AnimationActions(in_args.max_zoom, in_args.max_brightness, in_args.max_rotation,
+                                                in_args.max_blur, in_args.max_distortion, in_args.num_frames)
+
+        phase1_actions, phase2_actions = actions_determinator.get_actions_values(dh.animation)
+
+        final_phase_folder = AnimationImages.make_transition(dh.tmp_path, dh.phase1_images, dh.phase2_images,
+                                                             phase1_actions, phase2_actions, in_args.debug)
+
+        if not dh.final_images_to_video(final_phase_folder):
+            return None
+        if in_args.merge:
+            if not dh.merge_video_chunks():
+                return None
+            log_info(f"output transition video: {dh.merged_vid}")
+        else:
+            log_info(f"output transition phase1 video: {dh.phase1_vid}")
+            log_info(f"output transition phase2 video: {dh.phase2_vid}")
+        if in_args.remove:
+            log_debug(f"remove original video1: {dh.input_vid1}")
+            dh.input_vid1.unlink()
+            log_debug(f"remove original video2: {dh.input_vid2}")
+            dh.input_vid2.unlink()
+        log_info("")
+        log_info((f" Transition finished. Duration = {dh.get_duration_msg()} ".center(80, "=")))
+        log_info("")
+        end_print(in_args.art)
+        return dh.merged_vid if in_args.merge else (dh.phase1_vid, dh.phase2_vid)
+
+
+def make_transition_video(input_videos, output, animation=ANIMATION, num_frames=NUM_FRAMES, ranges=None,
+                          max_rotation=MAX_ROTATION, max_distortion=MAX_DISTORTION, max_blur=MAX_BLUR,
+                          max_brightness=MAX_BRIGHTNESS, max_zoom=MAX_ZOOM, fps=FPS, debug=DEBUG, art=ART,
+                          remove=REMOVE_ORIGINAL, merge=MERGE_PHASES):
+    """
+    in-process equivalent of running this script (same arguments as the command line), for callers
+    making many transitions: no interpreter start and no import per transition, and passing the `fps`
+    of the inputs skips probing them with ffmpeg. Returns the same as create_transition.
+    """
+    return create_transition(argparse.Namespace(
+        input=[str(video) for video in input_videos], ranges=list(ranges or INPUT_RANGES), num_frames=num_frames,
+        animation=animation, output=str(output), max_rotation=max_rotation, max_distortion=max_distortion,
+        max_blur=max_blur, max_brightness=max_brightness, max_zoom=max_zoom, fps=fps, debug=debug, art=art,
+        remove=remove, merge=merge))
+
+
+def make_transition_frames(in_frames1, in_frames2, animation=ANIMATION, max_rotation=MAX_ROTATION,
+                           max_distortion=MAX_DISTORTION, max_blur=MAX_BLUR, max_brightness=MAX_BRIGHTNESS,
+                           max_zoom=MAX_ZOOM):
+    """
+    frames version of make_transition_video: takes the last frames of the first clip and the first
+    frames of the second one (PIL images, twice as many for the long translations) and returns the two
+    lists of transition frames, without ffmpeg or any file
+    """
+    animation_enum = next((a for a in Animations if a.name == animation.lower().strip()), None)
+    if animation_enum is None:
+        raise ValueError(f"animation [{animation}] not recognized, possible animations: "
+                         f"{', '.join(a.name for a in Animations)}")
+    num_frames = len(in_frames1)
+    num_frames_for_vid2 = num_frames
+    if animation_enum in (Animations.long_translation, Animations.long_translation_inv):
+        num_frames_for_vid2 = 2 * num_frames
+    if num_frames < 2 or len(in_frames2) != num_frames_for_vid2:
+        raise ValueError(f"[{animation_enum.name}] needs at least 2 frames from the first clip and "
+                         f"[{num_frames_for_vid2}] from the second one, got [{num_frames}] and [{len(in_frames2)}]")
+    actions_determinator = AnimationActions(max_zoom, max_brightness, max_rotation, max_blur, max_distortion,
+                                            num_frames)
+    phase1_actions, phase2_actions = actions_determinator.get_actions_values(animation_enum)
+    return AnimationImages.transition_frames(in_frames1, in_frames2, phase1_actions, phase2_actions)
+
+
 def str2bool(v):
     if isinstance(v, bool):
         return v
@@ -927,6 +1147,9 @@ if __name__ == "__main__":
                                                  'of the first video, and the first part of the second video')
     parser.add_argument('-i', '--input', help='input videos, must be two', type=str,  nargs='+', metavar='\b',
                         default=INPUT_VIDEOS)
+    parser.add_argument('-c', '--ranges', help='use only a part of each input video: start1 end1 start2 end2 '
+                                               '(in seconds), e.g. two kill clips given as ranges of the same VOD',
+                        type=float, nargs='+', metavar='\b', default=INPUT_RANGES)
     parser.add_argument('-n', '--num_frames', help='the number of frames used for each animation phase, '
                                                    'most animations consists of two phases',
                         type=int, default=NUM_FRAMES, metavar='\b')
@@ -936,6 +1159,8 @@ if __name__ == "__main__":
     parser.add_argument('-o', '--output', help='the name of the output (determined automatically if left empty), '
                                                'FPS is copied from the first video.',
                         type=str, default=OUTPUT, metavar='\b')
+    parser.add_argument('-f', '--fps', help='frames per second of the output, read from the first video if 0',
+                        type=float, default=FPS, metavar='\b')
     parser.add_argument('-r', '--max_rotation', help=f'rotation (in degree) value at the midpoint of the animation, '
                                                      f'possible range {list(_LIMITS["rotation"])}',
                         type=int, default=MAX_ROTATION, metavar='\b')
@@ -965,36 +1190,4 @@ if __name__ == "__main__":
         print(_ANIMATION_HELP)
         exit(0)
 
-    with tempfile.TemporaryDirectory() as tmp_dir:
-        tmp_path = pathlib.Path(tmp_dir)
-        dh = DataHandler()
-        if not dh.verify_arguments(args, tmp_path):
-            exit(1)
-
-        actions_determinator = AnimationActions(args.max_zoom, args.max_brightness, args.max_rotation, args.max_blur,
-                                                args.max_distortion, args.num_frames)
-
-        phase1_actions, phase2_actions = actions_determinator.get_actions_values(dh.animation)
-
-        final_phase_folder = AnimationImages.make_transition(dh.tmp_path, dh.phase1_images, dh.phase2_images,
-                                                             phase1_actions, phase2_actions, args.debug)
-
-        if not dh.final_images_to_video(final_phase_folder):
-            exit(1)
-        if args.merge:
-            if not dh.merge_video_chunks():
-                exit(1)
-            log_info(f"output transition video: {dh.merged_vid}")
-        else:
-            log_info(f"output transition phase1 video: {dh.phase1_vid}")
-            log_info(f"output transition phase2 video: {dh.phase2_vid}")
-        if args.remove:
-            log_debug(f"remove original video1: {dh.input_vid1}")
-            dh.input_vid1.unlink()
-            log_debug(f"remove original video2: {dh.input_vid2}")
-            dh.input_vid2.unlink()
-        log_info("")
-        log_info((f" Transition finished. Duration = {dh.get_duration_msg()} ".center(80, "=")))
-        log_info("")
-        end_print(args.art)
-    exit(0)
+    exit(0 if create_transition(args) is not None else 1)